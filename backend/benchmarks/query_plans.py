@@ -0,0 +1,163 @@
+'''
+    - Seeds a throwaway database with 50k student assignments & compares query plans/timings before & after the db_models indexes
+    - Covers the lookups the API runs constantly: published run, routes of a run, stops of routes, run/stop/student assignments
+    - Uses BENCH_DATABASE_URL (defaults to a local SQLite file) --> never point it at the production database, all tables are dropped
+    - Run from backend/: python -m benchmarks.query_plans
+'''
+
+import os
+import time
+import random
+import statistics
+from datetime import time as dt_time
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "sqlite:///benchmarks/query_plans.db")
+os.environ.setdefault("DATABASE_URL", BENCH_DATABASE_URL)
+
+from sqlalchemy import create_engine, text, insert
+from database import Base
+from db_models import Student, OptimizationRun, Route, Stop, StudentAssignment
+from migrate import create_missing_indexes
+
+NUM_RUNS = 10
+ROUTES_PER_RUN = 50
+STOPS_PER_ROUTE = 10
+NUM_STUDENTS = 5000  # every student is assigned in every run --> 50k assignments
+REPEATS = 20
+
+QUERIES = {
+    "published run": (
+        "SELECT run_id FROM optimization_runs WHERE is_published = :published",
+        lambda p: {"published": True}
+    ),
+    "routes of run": (
+        "SELECT route_id, bus_number FROM routes WHERE run_id = :run_id",
+        lambda p: {"run_id": p["run_id"]}
+    ),
+    "stops of routes": (
+        "SELECT stop_id, route_id, address FROM stops WHERE route_id IN ({route_ids})",
+        lambda p: {}
+    ),
+    "run assignments + students": (
+        "SELECT sa.stop_id, sa.pickup_time, s.student_id, s.name FROM student_assignments sa "
+        "JOIN students s ON s.student_id = sa.student_id WHERE sa.run_id = :run_id",
+        lambda p: {"run_id": p["run_id"]}
+    ),
+    "stop assignments": (
+        "SELECT student_id FROM student_assignments WHERE run_id = :run_id AND stop_id = :stop_id",
+        lambda p: {"run_id": p["run_id"], "stop_id": p["stop_id"]}
+    ),
+    "student assignment": (
+        "SELECT route_id, stop_id FROM student_assignments WHERE run_id = :run_id AND student_id = :student_id",
+        lambda p: {"run_id": p["run_id"], "student_id": p["student_id"]}
+    )
+}
+
+
+# Drops indexes declared in db_models so the first pass shows the plans without them
+def drop_model_indexes(engine):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+
+def seed(engine) -> dict:
+    rng = random.Random(0)
+    students = [
+        {"student_id": f"S{i:05d}", "name": f"Student {i}", "home_latitude": 40.4 + rng.random() * 0.2, "home_longitude": -74.7 + rng.random() * 0.2, "is_walker": False}
+        for i in range(NUM_STUDENTS)
+    ]
+    runs, routes, stops, assignments = [], [], [], []
+    route_id, stop_id = 0, 0
+
+    for run_id in range(1, NUM_RUNS + 1):
+        runs.append({"run_id": run_id, "name": f"Run {run_id}", "is_published": run_id == NUM_RUNS, "buses_needed": ROUTES_PER_RUN})
+        run_stops = []
+        for bus in range(ROUTES_PER_RUN):
+            route_id += 1
+            routes.append({"route_id": route_id, "run_id": run_id, "bus_number": bus + 1, "total_students": 0})
+            for seq in range(STOPS_PER_ROUTE):
+                stop_id += 1
+                stops.append({"stop_id": stop_id, "route_id": route_id, "latitude": 40.5, "longitude": -74.6, "sequence_number": seq + 1, "address": f"Stop {stop_id}"})
+                run_stops.append((route_id, stop_id))
+        for i, student in enumerate(students):
+            stop_route, stop = run_stops[i % len(run_stops)]
+            assignments.append({"student_id": student["student_id"], "run_id": run_id, "route_id": stop_route, "stop_id": stop, "pickup_time": dt_time(7, 15)})
+
+    with engine.begin() as conn:
+        for model, rows in ((Student, students), (OptimizationRun, runs), (Route, routes), (Stop, stops), (StudentAssignment, assignments)):
+            conn.execute(insert(model), rows)
+
+    published_routes = [r["route_id"] for r in routes if r["run_id"] == NUM_RUNS]
+    print(f"Seeded {len(runs)} runs, {len(routes)} routes, {len(stops)} stops, {len(students)} students, {len(assignments)} assignments")
+    return {
+        "run_id": NUM_RUNS,
+        "route_ids": published_routes,
+        "stop_id": stops[-1]["stop_id"],
+        "student_id": students[NUM_STUDENTS // 2]["student_id"]
+    }
+
+def analyze(engine):
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+# Query plan text for the current dialect (PostgreSQL runs EXPLAIN ANALYZE)
+def explain(conn, sql, params) -> str:
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), params)
+        return "\n".join(row[0] for row in rows)
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)
+        return "\n".join(row[-1] for row in rows)
+    return "(plan not available for this database)"
+
+# Median & p95 time in ms over REPEATS executions
+def time_query(conn, statement, params):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        conn.execute(statement, params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def run_queries(engine, lookup: dict, label: str) -> dict:
+    results = {}
+    print(f"\n=== {label} ===")
+    with engine.connect() as conn:
+        for name, (sql, make_params) in QUERIES.items():
+            # Route ids (integers) are written into the IN list, like selectinload's batch of parent ids
+            sql = sql.format(route_ids=", ".join(str(route_id) for route_id in lookup["route_ids"]))
+            params = make_params(lookup)
+
+            median_ms, p95_ms = time_query(conn, text(sql), params)
+            results[name] = median_ms
+            print(f"\n-- {name}: median {median_ms:.2f} ms, p95 {p95_ms:.2f} ms")
+            print(explain(conn, sql, params))
+    return results
+
+
+def main():
+    engine = create_engine(BENCH_DATABASE_URL)
+    print(f"Benchmark database: {engine.url.render_as_string(hide_password=True)}")
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    drop_model_indexes(engine)
+    lookup = seed(engine)
+
+    analyze(engine)
+    before = run_queries(engine, lookup, "Without db_models indexes")
+
+    created = create_missing_indexes(engine)
+    print(f"\nCreated indexes: {', '.join(created)}")
+    analyze(engine)
+    after = run_queries(engine, lookup, "With db_models indexes")
+
+    print("\n=== Summary (median ms) ===")
+    print(f"{'query':<30}{'before':>10}{'after':>10}{'speedup':>10}")
+    for name in QUERIES:
+        print(f"{name:<30}{before[name]:>10.2f}{after[name]:>10.2f}{before[name] / max(after[name], 1e-6):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+'''
+    - Bulk database writes shared by the API endpoints
+    - Students are upserted in batches (INSERT ... ON CONFLICT DO UPDATE on PostgreSQL & SQLite) instead of one query per row
+    - Saved runs are written with a few bulk statements: route & stop ids come back from RETURNING, assignments go in one executemany
+    - Saved runs are read back with a fixed number of queries (routes + selectin stops, then one assignments/students join)
+'''
+
+from datetime import datetime
+from typing import Dict, List, Tuple, Optional, Sequence
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.dialects import postgresql, sqlite
+from db_models import Student, OptimizationRun, Route, Stop, StudentAssignment
+
+UPSERT_BATCH_SIZE = 1000
+STUDENT_COLUMNS = ("name", "home_latitude", "home_longitude", "is_walker", "walking_distance_km")
+
+
+# Returns which of the given student ids already exist (one query per batch of ids)
+def existing_student_ids(db: Session, student_ids: Sequence[str]) -> set:
+    existing = set()
+    for start in range(0, len(student_ids), UPSERT_BATCH_SIZE):
+        batch = student_ids[start:start + UPSERT_BATCH_SIZE]
+        existing.update(sid for (sid,) in db.query(Student.student_id).filter(Student.student_id.in_(batch)))
+    return existing
+
+# Inserts new students & updates existing ones in batches, returns (inserted, updated) counts
+# rows are dicts keyed by Student column names; update_columns limits which columns overwrite existing rows
+def upsert_students(db: Session, rows: List[Dict], update_columns: Optional[Sequence[str]] = None) -> Tuple[int, int]:
+    if not rows:
+        return 0, 0
+
+    # Last row wins for repeated ids (one statement can't update the same row twice)
+    rows = list({row["student_id"]: row for row in rows}.values())
+    columns = [c for c in (update_columns or STUDENT_COLUMNS) if c in rows[0]]
+    existing = existing_student_ids(db, [row["student_id"] for row in rows])
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            stmt = dialect_insert(Student).values(rows[start:start + UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Student.student_id],
+                set_={c: stmt.excluded[c] for c in columns}
+            )
+            db.execute(stmt)
+    else:
+        # Other databases: executemany insert for new ids & bulk update by primary key for the rest
+        new_rows = [row for row in rows if row["student_id"] not in existing]
+        updates = [{"student_id": row["student_id"], **{c: row[c] for c in columns}} for row in rows if row["student_id"] in existing]
+        if new_rows:
+            db.execute(insert(Student), new_rows)
+        if updates:
+            db.execute(update(Student), updates)
+
+    inserted = len(rows) - len(existing)
+    print(f"Upserted {len(rows)} students ({inserted} new, {len(existing)} updated)")
+    return inserted, len(existing)
+
+
+# Inserts rows & returns their generated primary keys in the same order
+def insert_returning_ids(db: Session, model, pk_column, rows: List[Dict]) -> List[int]:
+    if not rows:
+        return []
+    if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        return list(db.scalars(insert(model).returning(pk_column, sort_by_parameter_order=True), rows))
+    # Databases without ordered RETURNING on executemany: one insert per row
+    return [db.execute(insert(model).values(row)).inserted_primary_key[0] for row in rows]
+
+# Parses payload pickup times (ISO datetimes) into times, None when missing or malformed
+def _pickup_time(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).time()
+    except ValueError:
+        return None
+
+# Writes a run with its routes, stops, students & assignments in bulk (caller commits) --> (run_id, students saved)
+def insert_run(db: Session, run_data) -> Tuple[int, int]:
+    new_run = OptimizationRun(
+        timestamp=datetime.utcnow(),
+        is_published=False,
+        total_students_uploaded=run_data.total_students_uploaded,
+        total_walkers=run_data.total_walkers,
+        total_bus_riders=run_data.total_bus_riders,
+        buses_needed=run_data.buses_needed,
+        name=run_data.name,
+        overview_json=run_data.overview,
+        elbow_json=run_data.elbow,
+        stage_timings_json=run_data.stage_timings,
+        map_path=run_data.map_path
+    )
+    db.add(new_run)
+    db.flush()
+
+    route_ids = insert_returning_ids(db, Route, Route.route_id, [
+        {
+            "run_id": new_run.run_id,
+            "bus_number": route.bus_number,
+            "total_students": route.total_students,
+            "total_distance_km": route.total_distance_km,
+            "estimated_duration_hr": route.estimated_duration_hr,
+            "map_path": route.map_path
+        }
+        for route in run_data.route_details
+    ])
+
+    # Addresses are filled by a background task once the run is saved
+    stop_routes = [(route_id, stop) for route_id, route in zip(route_ids, run_data.route_details) for stop in route.stops]
+    stop_ids = insert_returning_ids(db, Stop, Stop.stop_id, [
+        {
+            "route_id": route_id,
+            "latitude": stop.latitude,
+            "longitude": stop.longitude,
+            "sequence_number": stop.sequence_number,
+            "address": None
+        }
+        for route_id, stop in stop_routes
+    ])
+
+    # Students: new ones are created, existing ones get their name & home location refreshed
+    stop_students = [(route_id, stop_id, student) for stop_id, (route_id, stop) in zip(stop_ids, stop_routes) for student in stop.students]
+    upsert_students(db, [
+        {
+            "student_id": student.student_id,
+            "name": student.name,
+            "home_latitude": student.latitude,
+            "home_longitude": student.longitude
+        }
+        for _, _, student in stop_students
+    ], update_columns=("name", "home_latitude", "home_longitude"))
+
+    if stop_students:
+        db.execute(insert(StudentAssignment), [
+            {
+                "student_id": student.student_id,
+                "run_id": new_run.run_id,
+                "route_id": route_id,
+                "stop_id": stop_id,
+                "pickup_time": _pickup_time(student.pickup_time)
+            }
+            for route_id, stop_id, student in stop_students
+        ])
+
+    return new_run.run_id, len(stop_students)
+
+
+# Loads a run's routes (stops eager loaded) & every assigned student in 3 queries --> [(route, stops_data)]
+# stops_data is the serialized stop list shared by get_run & get_published_run
+def load_run_routes(db: Session, run_id: int) -> List[Tuple[Route, List[Dict]]]:
+    routes = (
+        db.query(Route)
+        .options(selectinload(Route.stops))
+        .filter(Route.run_id == run_id)
+        .order_by(Route.route_id)
+        .all()
+    )
+
+    # All assignments of the run joined with their students, grouped by stop
+    rows = (
+        db.query(
+            StudentAssignment.stop_id,
+            StudentAssignment.pickup_time,
+            Student.student_id,
+            Student.name,
+            Student.home_latitude,
+            Student.home_longitude
+        )
+        .join(Student, Student.student_id == StudentAssignment.student_id)
+        .filter(StudentAssignment.run_id == run_id)
+        .order_by(StudentAssignment.assignment_id)
+        .all()
+    )
+    students_by_stop = {}
+    for stop_id, pickup_time, student_id, name, latitude, longitude in rows:
+        students_by_stop.setdefault(stop_id, []).append({
+            "student_id": student_id,
+            "name": name,
+            "pickup_time": pickup_time.isoformat() if pickup_time else None,
+            "latitude": float(latitude),
+            "longitude": float(longitude)
+        })
+
+    return [
+        (route, [
+            {
+                "stop_id": stop.stop_id,
+                "address": stop.address,
+                "latitude": float(stop.latitude),
+                "longitude": float(stop.longitude),
+                "sequence_number": stop.sequence_number,
+                "students": students_by_stop.get(stop.stop_id, [])
+            }
+            for stop in sorted(route.stops, key=lambda stop: stop.stop_id)
+        ])
+        for route in routes
+    ]
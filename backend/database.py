@@ -1,14 +1,92 @@
+'''
+    - Database engine, session factory & declarative base shared by the backend
+    - Connection pool is sized from the environment: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+    - Pool metrics (checkouts, waits on an exhausted pool & their times, timeouts, connections opened) are counted per API process --> pool_metrics()
+    - Requests use get_db, background tasks & job callbacks use session_scope, so every session is closed & its connection returned
+'''
+
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 = never recycle
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+_metrics = {
+    "checkouts": 0,
+    "checkins": 0,
+    "connects": 0,
+    "invalidated": 0,
+    "timeouts": 0,
+    "waits": 0,
+    "wait_total_s": 0.0,
+    "wait_max_s": 0.0
+}
+_metrics_lock = threading.Lock()
+
+
+# QueuePool that times checkouts which had to wait for a connection to be returned
+# Only checkouts that find the pool exhausted (nothing idle, overflow used up) block; overflow checkouts open a connection instead
+class MeteredQueuePool(QueuePool):
+    def _do_get(self):
+        exhausted = self._max_overflow > -1 and self.overflow() >= self._max_overflow and self.checkedin() == 0
+        if not exhausted:
+            return super()._do_get()
+
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with _metrics_lock:
+                _metrics["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with _metrics_lock:
+                _metrics["waits"] += 1
+                _metrics["wait_total_s"] += waited
+                _metrics["wait_max_s"] = max(_metrics["wait_max_s"], waited)
+
+# Pool arguments for the URL: in memory SQLite keeps SQLAlchemy's single connection pool
+def pool_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+def _count(name):
+    def listener(*args):
+        with _metrics_lock:
+            _metrics[name] += 1
+    return listener
+
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+
+for pool_event, name in (("checkout", "checkouts"), ("checkin", "checkins"), ("connect", "connects"), ("invalidate", "invalidated")):
+    event.listen(engine, pool_event, _count(name))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -20,3 +98,42 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Session for code outside a request (background tasks, job callbacks): rolls back on error & always closes
+@contextmanager
+def session_scope():
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Pool configuration, current usage & counters since the process started
+def pool_metrics() -> dict:
+    pool = engine.pool
+    with _metrics_lock:
+        counters = dict(_metrics)
+    wait_total_s = counters.pop("wait_total_s")
+    wait_max_s = counters.pop("wait_max_s")
+    stats = {
+        "pool_class": pool.__class__.__name__,
+        **counters,
+        "wait_total_s": round(wait_total_s, 4),
+        "wait_avg_ms": round(wait_total_s / counters["waits"] * 1000, 3) if counters["waits"] else 0.0,
+        "wait_max_ms": round(wait_max_s * 1000, 3)
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout_s": DB_POOL_TIMEOUT,
+            "pool_recycle_s": DB_POOL_RECYCLE,
+            "pre_ping": DB_POOL_PRE_PING,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow()
+        })
+    return stats
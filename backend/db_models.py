@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, Time, ForeignKey, DateTime, JSON, Float, UniqueConstraint, Text
+from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, Time, ForeignKey, DateTime, JSON, Float, UniqueConstraint, Text, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -46,7 +46,14 @@ class OptimizationRun(Base):
     total_bus_riders = Column(Integer)
     buses_needed = Column(Integer)
     overview_json = Column(JSON)
+    elbow_json = Column(JSON, nullable=True)
+    stage_timings_json = Column(JSON, nullable=True)
     map_path = Column(Text)
+
+    # At most one published run (partial index, only on databases that support them)
+    __table_args__ = (
+        Index("uq_optimization_runs_published", "is_published", unique=True, postgresql_where=is_published == True, sqlite_where=is_published == True).ddl_if(dialect=("postgresql", "sqlite")),
+    )
     
     # Relationships
     routes = relationship("Route", back_populates="run", cascade="all, delete-orphan")
@@ -63,6 +70,10 @@ class Route(Base):
     estimated_duration_hr = Column(Float)
     run_id = Column(Integer, ForeignKey("optimization_runs.run_id", ondelete="CASCADE"))
     map_path = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_routes_run_id", "run_id"),
+    )
     
     # Relationships
     run = relationship("OptimizationRun", back_populates="routes")
@@ -79,6 +90,10 @@ class Stop(Base):
     address = Column(Text)
     sequence_number = Column(Integer, nullable=False)
     route_id = Column(Integer, ForeignKey("routes.route_id", ondelete="CASCADE"))
+
+    __table_args__ = (
+        Index("ix_stops_route_id", "route_id"),
+    )
     
     # Relationships
     route = relationship("Route", back_populates="stops")
@@ -98,6 +113,8 @@ class StudentAssignment(Base):
     
     __table_args__ = (
         UniqueConstraint('student_id', 'run_id', name='uq_student_run'),
+        Index('ix_assignments_run_stop', 'run_id', 'stop_id'),
+        Index('ix_assignments_run_student', 'run_id', 'student_id'),
     )
     
     # Relationships
@@ -143,3 +160,10 @@ class Admin(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
+
+class GeocodedAddress(Base):
+    __tablename__ = "geocoded_addresses"
+    coord_key = Column(String(40), primary_key=True)  # "lat,lon" rounded to GEOCODE_PRECISION decimals
+    address = Column(Text, nullable=False)
+    provider = Column(String(20), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
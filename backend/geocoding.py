@@ -0,0 +1,179 @@
+'''
+    - Reverse geocodes stop coordinates into street addresses
+    - Persistent cache table (geocoded_addresses) keyed by coordinates rounded to GEOCODE_PRECISION decimals --> reused stops never hit the network
+    - Cache misses are looked up concurrently (GEOCODE_WORKERS threads) behind a shared rate limit (GEOCODE_RATE_PER_S)
+    - GEOCODER=google uses the Google Geocoding API, GEOCODER=offline returns a local placeholder address (tests / no API key)
+    - Saved runs get their stop addresses filled in the background, batch by batch, after save_run has returned (lookups run with no database transaction open)
+'''
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional, Sequence, Tuple
+import requests
+from dotenv import load_dotenv
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from database import session_scope
+from db_models import GeocodedAddress, Route, Stop
+from snapshots import invalidate_snapshot
+
+load_dotenv()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEOCODER = os.getenv("GEOCODER", "google" if GOOGLE_API_KEY else "offline")
+GEOCODE_PRECISION = int(os.getenv("GEOCODE_PRECISION", "5"))
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "8"))
+GEOCODE_RATE_PER_S = float(os.getenv("GEOCODE_RATE_PER_S", "20"))
+GEOCODE_TIMEOUT_S = float(os.getenv("GEOCODE_TIMEOUT_S", "5"))
+CACHE_BATCH_SIZE = 500
+ADDRESS_FILL_BATCH_SIZE = int(os.getenv("ADDRESS_FILL_BATCH_SIZE", "100"))
+UNAVAILABLE_ADDRESS = "Address unavailable"
+
+
+# Spaces out calls across threads so at most rate_per_s requests start each second
+class RateLimiter:
+    def __init__(self, rate_per_s: float):
+        self.interval = 1 / rate_per_s if rate_per_s > 0 else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+_rate_limiter = RateLimiter(GEOCODE_RATE_PER_S)
+
+
+# Rounds coordinates to the cache precision --> "lat,lon" key
+def coord_key(lat: float, lon: float, precision: int = GEOCODE_PRECISION) -> str:
+    return f"{round(float(lat), precision):.{precision}f},{round(float(lon), precision):.{precision}f}"
+
+# Uses Google Geocoding API to get address from lat/lon (None when the lookup fails, so failures aren't cached)
+def google_reverse_geocode(lat: float, lon: float, api_key: Optional[str] = GOOGLE_API_KEY) -> Optional[str]:
+    try:
+        url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={api_key}"
+        response = requests.get(url, timeout=GEOCODE_TIMEOUT_S)
+        data = response.json()
+
+        if data["status"] == "OK":
+            return data["results"][0]["formatted_address"]
+        elif data["status"] == "OVER_QUERY_LIMIT":
+            print("Google API rate limit exceeded!")
+        elif data["status"] == "REQUEST_DENIED":
+            print(f"API request denied: {data.get('error_message', 'No error message')}")
+        else:
+            print(f"Geocoding failed with status: {data['status']}")
+    except Exception as e:
+        print(f"Geocoding error: {str(e)}")
+    return None
+
+# Local stand-in that never touches the network
+def offline_reverse_geocode(lat: float, lon: float) -> Optional[str]:
+    return f"Stop at {float(lat):.5f}, {float(lon):.5f}"
+
+PROVIDERS = {
+    "google": google_reverse_geocode,
+    "offline": offline_reverse_geocode
+}
+
+
+# Reads cached addresses for the given keys (one query per batch)
+def _read_cache(db: Session, keys: Sequence[str]) -> Dict[str, str]:
+    cached = {}
+    for start in range(0, len(keys), CACHE_BATCH_SIZE):
+        batch = keys[start:start + CACHE_BATCH_SIZE]
+        rows = db.query(GeocodedAddress.coord_key, GeocodedAddress.address).filter(GeocodedAddress.coord_key.in_(batch))
+        cached.update({key: address for key, address in rows})
+    return cached
+
+# Stores new addresses, ignoring keys another request cached in the meantime
+def _write_cache(db: Session, addresses: Dict[str, str], provider: str):
+    rows = [{"coord_key": key, "address": address, "provider": provider, "created_at": datetime.utcnow()} for key, address in addresses.items()]
+    if not rows:
+        return
+
+    dialect = db.get_bind().dialect.name
+    for start in range(0, len(rows), CACHE_BATCH_SIZE):
+        batch = rows[start:start + CACHE_BATCH_SIZE]
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            db.execute(dialect_insert(GeocodedAddress).values(batch).on_conflict_do_nothing(index_elements=[GeocodedAddress.coord_key]))
+        else:
+            for row in batch:
+                db.merge(GeocodedAddress(**row))
+
+
+# Looks up addresses for cache misses concurrently behind the shared rate limit (network only, no database access)
+# Returns only the lookups that succeeded
+def lookup_addresses(keys: Sequence[str], provider: str = GEOCODER) -> Dict[str, str]:
+    if not keys:
+        return {}
+    lookup = PROVIDERS[provider]
+
+    def fetch(key):
+        lat, lon = key.split(",")
+        if provider != "offline":
+            _rate_limiter.wait()
+        return lookup(lat, lon)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(GEOCODE_WORKERS, len(keys)))) as pool:
+        found = dict(zip(keys, pool.map(fetch, keys)))
+    return {key: address for key, address in found.items() if address}
+
+
+# Fills stops of a run that have no address yet, batch by batch (background task after save_run)
+# Each batch reads stops & cached addresses in one short session, looks up misses with no transaction open, then writes cache rows & Stop.address in a second short session
+# Failed lookups are stored as UNAVAILABLE_ADDRESS so the run still counts as complete
+def fill_run_addresses(run_id: int, batch_size: int = ADDRESS_FILL_BATCH_SIZE, provider: str = GEOCODER):
+    filled = 0
+    try:
+        while True:
+            with session_scope() as db:
+                stops = (
+                    db.query(Stop.stop_id, Stop.latitude, Stop.longitude)
+                    .join(Route, Stop.route_id == Route.route_id)
+                    .filter(Route.run_id == run_id, Stop.address.is_(None))
+                    .order_by(Stop.stop_id)
+                    .limit(batch_size)
+                    .all()
+                )
+                keys = [coord_key(lat, lon) for _, lat, lon in stops]
+                unique_keys = list(dict.fromkeys(keys))
+                addresses = _read_cache(db, unique_keys)
+            if not stops:
+                break
+
+            misses = [key for key in unique_keys if key not in addresses]
+            new_addresses = lookup_addresses(misses, provider)
+            addresses.update(new_addresses)
+            if misses:
+                print(f"Geocoded {len(unique_keys)} locations: {len(unique_keys) - len(misses)} cached, {len(new_addresses)} looked up, {len(misses) - len(new_addresses)} failed")
+
+            with session_scope() as db:
+                _write_cache(db, new_addresses, provider)
+                db.execute(update(Stop), [{"stop_id": stop_id, "address": addresses.get(key, UNAVAILABLE_ADDRESS)} for (stop_id, _, _), key in zip(stops, keys)])
+                db.commit()
+            invalidate_snapshot("addresses filled")
+            filled += len(stops)
+        print(f"Filled {filled} stop addresses for run {run_id}")
+    except Exception as e:
+        print(f"ERROR filling addresses for run {run_id}: {str(e)}")
+
+# Counts stops & resolved addresses per run (all runs when run_ids is None) --> {run_id: (total_stops, resolved_stops)}
+def address_counts(db: Session, run_ids: Optional[Sequence[int]] = None) -> Dict[int, Tuple[int, int]]:
+    query = (
+        db.query(Route.run_id, func.count(Stop.stop_id), func.count(Stop.address))
+        .join(Stop, Stop.route_id == Route.route_id)
+        .group_by(Route.run_id)
+    )
+    if run_ids is not None:
+        query = query.filter(Route.run_id.in_(run_ids))
+    return {run_id: (total, resolved) for run_id, total, resolved in query}
@@ -0,0 +1,168 @@
+'''
+    - In-process job queue that runs the optimization pipeline in a worker process so the API stays responsive
+    - Workers report each pipeline stage through a shared dict --> status endpoint shows current stage & stage timings
+    - Finished results are kept in memory until they expire (JOB_RESULT_TTL_S)
+    - Completion callbacks (storing students, drawing plots) run on a small thread pool, never on the process pool's management thread
+'''
+
+import os
+import time
+import uuid
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_RESULT_TTL_S = float(os.getenv("JOB_RESULT_TTL_S", "3600"))
+JOB_COMPLETION_WORKERS = int(os.getenv("JOB_COMPLETION_WORKERS", "2"))
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+_completion_executor = None
+_manager = None
+_progress = None
+
+
+# Starts the worker pool, the completion threads & the manager holding worker progress on first use
+def _get_executor():
+    global _executor, _completion_executor, _manager, _progress
+    with _lock:
+        if _executor is None:
+            # Spawned workers don't inherit the API's threads or open DB connections
+            context = multiprocessing.get_context("spawn")
+            _manager = context.Manager()
+            _progress = _manager.dict()
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=context)
+            _completion_executor = ThreadPoolExecutor(max_workers=JOB_COMPLETION_WORKERS, thread_name_prefix="job-complete")
+    return _executor
+
+# Progress callback passed to the pipeline inside the worker (appends (stage, timestamp) for its job)
+class _StageReporter:
+    def __init__(self, progress, job_id: str):
+        self.progress = progress
+        self.job_id = job_id
+
+    def __call__(self, stage: str):
+        # Manager dict values are copies, so the list is reassigned rather than appended in place
+        self.progress[self.job_id] = self.progress.get(self.job_id, []) + [(stage, time.time())]
+
+# Runs in the worker process
+def _run_pipeline_job(job_id: str, progress, pipeline_kwargs: Dict):
+    from models.optimizer import full_optimization_pipeline
+
+    reporter = _StageReporter(progress, job_id)
+    reporter("started")
+    # Workers run one job at a time, so the pipeline may reset the process' peak memory counter per stage
+    return full_optimization_pipeline(**pipeline_kwargs, progress=reporter, dedicated_process=True)
+
+
+# Turns stage events into per-stage durations (the running stage is timed up to now)
+def _stage_timings(events, end_time: float):
+    timings = []
+    for i, (stage, started_at) in enumerate(events):
+        if stage in ("started", "done"):
+            continue
+        ended_at = events[i + 1][1] if i + 1 < len(events) else end_time
+        timings.append({"stage": stage, "seconds": round(ended_at - started_at, 3)})
+    return timings
+
+# Drops finished jobs older than the TTL
+def _expire_jobs():
+    now = time.time()
+    with _lock:
+        expired = [
+            job_id for job_id, job in _jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > JOB_RESULT_TTL_S
+        ]
+        for job_id in expired:
+            _jobs.pop(job_id)
+    for job_id in expired:
+        if _progress is not None:
+            _progress.pop(job_id, None)
+
+
+# Records a job's final status (status is set last so pollers never see "done" without the result)
+def _set_job_status(job_id: str, job_status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+    job = _jobs.get(job_id)
+    if job is None:
+        return
+    job["result"] = result
+    job["error"] = error
+    job["finished_at"] = time.time()
+    job["status"] = job_status
+
+# Runs on a completion thread: applies on_complete to the worker's results & marks the job done or failed
+def _complete_job(job_id: str, future, on_complete: Optional[Callable[[Dict], Dict]]):
+    if job_id not in _jobs:
+        return
+    try:
+        if future.cancelled():
+            raise RuntimeError("Job was cancelled")
+        results = future.result()
+        _set_job_status(job_id, "done", result=on_complete(results) if on_complete else results)
+    except Exception as e:
+        print(f"ERROR in job {job_id}: {str(e)}")
+        print(traceback.format_exc())
+        _set_job_status(job_id, "failed", error=str(e))
+
+
+# Queues a pipeline run & returns its job id
+# on_complete(results) runs in the API process (on a completion thread) once the worker finishes & its return value becomes the job result
+def submit_job(pipeline_kwargs: Dict, on_complete: Optional[Callable[[Dict], Dict]] = None) -> str:
+    _expire_jobs()
+    executor = _get_executor()
+    job_id = uuid.uuid4().hex
+
+    with _lock:
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+
+    future = executor.submit(_run_pipeline_job, job_id, _progress, pipeline_kwargs)
+
+    # Called from the executor's management thread --> only hands the result to a completion thread
+    def _finish(future):
+        try:
+            _completion_executor.submit(_complete_job, job_id, future, on_complete)
+        except RuntimeError as e:
+            _set_job_status(job_id, "failed", error=str(e))
+
+    future.add_done_callback(_finish)
+    print(f"Queued optimization job {job_id}")
+    return job_id
+
+# Returns job status, current stage & stage timings (None for unknown/expired jobs)
+def get_job(job_id: str) -> Optional[Dict]:
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+
+    events = list(_progress.get(job_id, [])) if _progress is not None else []
+    job_status = job["status"]
+    if job_status == "queued" and events:
+        job_status = "running"
+
+    end_time = job["finished_at"] or time.time()
+    return {
+        "job_id": job_id,
+        "status": job_status,
+        "stage": events[-1][0] if events else None,
+        "stage_timings": _stage_timings(events, end_time),
+        "queued_seconds": round((events[0][1] if events else end_time) - job["created_at"], 3),
+        "elapsed_seconds": round(end_time - job["created_at"], 3),
+        "error": job["error"]
+    }
+
+# Returns the result of a finished job (None while it's still queued/running)
+def get_job_result(job_id: str) -> Optional[Dict]:
+    job = _jobs.get(job_id)
+    return job["result"] if job and job["status"] == "done" else None
@@ -6,9 +6,8 @@
 import os
 import io
 import hashlib
-import requests
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict
 from dotenv import load_dotenv
 import pandas as pd
 from passlib.context import CryptContext
@@ -20,12 +19,15 @@ from fastapi import (
     File,
     Form,
     Body,
+    BackgroundTasks,
+    Request,
     status
 )
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from database import get_db, SessionLocal
+from database import get_db, session_scope, pool_metrics
 from db_models import (
     Student,
     Route,
@@ -33,17 +35,21 @@ from db_models import (
     OptimizationRun,
     Feedback,
     Admin,
-    StudentAssignment,
-    User,
     BusLocation
 )
-from models.optimizer import full_optimization_pipeline
-from run import RunPayload, AdminLoginRequest, LocationUpdate, AdminSignupRequest
+from models.plots import render_elbow_plot
+from models.incremental import apply_roster_changes, refresh_overview, distance_to_school_km
+from jobs import submit_job, get_job, get_job_result
+from crud import upsert_students, insert_run, load_run_routes
+from geocoding import fill_run_addresses, address_counts
+from snapshots import get_snapshot, snapshot_version, make_snapshot, empty_snapshot, store_snapshot, invalidate_snapshot, snapshot_response
+from run import RunPayload, RosterDeltaPayload, AdminLoginRequest, LocationUpdate, AdminSignupRequest
 import re
 
 load_dotenv()
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+SCHOOL_COORDS = (40.496296, -74.654846)
+SAFE_WALK_MILES = 1.5
 
 app = FastAPI()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -93,297 +99,214 @@ def normalize_csv_columns(df):
     
     return df
 
-# Accepts CSV of students, normalizes columns, runs optimization pipeline, & stores walkers & bus riders
-@app.post("/upload_csv")
-async def upload_csv(file: UploadFile = File(...), num_bus: int = Form(60), bus_capacity: int = Form(45), db: Session = Depends(get_db)):
-    try:
-    
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
-        
-        
-        # Normalizes column names
-        df = normalize_csv_columns(df)
+# Returns stop coordinates of the published run, route by route in pickup order (used to warm start the VRP)
+def get_published_route_coords(db: Session):
+    published_run = db.query(OptimizationRun).filter_by(is_published=True).first()
+    if not published_run:
+        return None
+
+    rows = (
+        db.query(Stop.route_id, Stop.latitude, Stop.longitude)
+        .join(Route, Stop.route_id == Route.route_id)
+        .filter(Route.run_id == published_run.run_id)
+        .order_by(Route.bus_number, Stop.sequence_number)
+        .all()
+    )
 
-        # Drops rows with missing data
-        initial_count = len(df)
-        df.dropna(inplace=True)
-        dropped_count = initial_count - len(df)
-        if dropped_count > 0:
-            print(f"Dropped {dropped_count} rows with missing data")
-
-        num_bus = int(num_bus)
-        bus_capacity = int(bus_capacity)
-
-        # Runs pipeline
-        results = full_optimization_pipeline(
-            df=df,
-            school_coords=(40.496296, -74.654846),
-            bus_capacity=bus_capacity,
-            num_bus=num_bus,
-            safe_walk_miles=1.5,
-            generate_map=True,
-            precompute=True
-        )
+    routes = {}
+    for route_id, latitude, longitude in rows:
+        routes.setdefault(route_id, []).append((float(latitude), float(longitude)))
+    return list(routes.values())
 
-        # Stores all students (walkers + bus riders)
-        stored_walkers = 0
-        stored_riders = 0
-        
-        if 'df_with_analysis' in results:
-            df_analyzed = results['df_with_analysis']
-            
-            for _, row in df_analyzed.iterrows():
-                student_id = str(row['StudentID'])
-                name = str(row['Name'])
-                latitude = float(row['Latitude'])
-                longitude = float(row['Longitude'])
-                needs_bus = bool(row['needs_bus'])
-                distance_to_school = float(row.get('distance_to_school_km', 0))
-                
-                # Checks if student exists
-                db_student = db.query(Student).filter_by(student_id=student_id).first()
-                
-                if db_student:
-                    db_student.name = name
-                    db_student.home_latitude = latitude
-                    db_student.home_longitude = longitude
-                    db_student.is_walker = not needs_bus  
-                    db_student.walking_distance_km = distance_to_school 
-                else:
-                    db_student = Student(
-                        student_id=student_id,
-                        name=name,
-                        home_latitude=latitude,
-                        home_longitude=longitude,
-                        is_walker=not needs_bus, 
-                        walking_distance_km=distance_to_school 
-                    )
-                    db.add(db_student)
-                
-                if needs_bus:
-                    stored_riders += 1
-                else:
-                    stored_walkers += 1
-                    
-            db.commit()
-        else:
-            print("WARNING: df_with_analysis not found in results.")
+# Reads uploaded CSV, normalizes columns, & drops rows with missing data
+def read_students_csv(contents: bytes):
+    df = pd.read_csv(io.BytesIO(contents))
 
-        return {
-            "filename": file.filename,
-            "num_rows": len(df),
-            "num_buses": results.get("num_bus", 0),
-            "bus_loads": results.get("bus_loads", []),
-            "overview": results.get("overview", []),
-            "route_details": results.get("route_details", []),
-            "map_path": results.get("map_path"),
-            "walkers_stored": stored_walkers,
-            "riders_stored": stored_riders
-        }
+    # Normalizes column names
+    df = normalize_csv_columns(df)
 
-    except Exception as e:
-        db.rollback()
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in upload_csv: {str(e)}")
-        print(error_details)
-        return {"error": str(e), "details": error_details}
+    # Drops rows with missing data
+    initial_count = len(df)
+    df.dropna(inplace=True)
+    dropped_count = initial_count - len(df)
+    if dropped_count > 0:
+        print(f"Dropped {dropped_count} rows with missing data")
+    return df
+
+# Stores all students (walkers + bus riders) from the pipeline's analyzed dataframe & returns (walkers, riders) counts
+def store_analyzed_students(db: Session, results: Dict):
+    stored_walkers = 0
+    stored_riders = 0
+
+    if 'df_with_analysis' not in results:
+        print("WARNING: df_with_analysis not found in results.")
+        return stored_walkers, stored_riders
+
+    df_analyzed = results['df_with_analysis']
+    needs_bus = df_analyzed['needs_bus'].astype(bool)
+    distance_to_school = df_analyzed['distance_to_school_km'] if 'distance_to_school_km' in df_analyzed else 0
+
+    # One upsert per batch instead of a lookup per student
+    rows = pd.DataFrame({
+        'student_id': df_analyzed['StudentID'].astype(str),
+        'name': df_analyzed['Name'].astype(str),
+        'home_latitude': df_analyzed['Latitude'].astype(float),
+        'home_longitude': df_analyzed['Longitude'].astype(float),
+        'is_walker': ~needs_bus,
+        'walking_distance_km': distance_to_school
+    }).to_dict(orient='records')
+    upsert_students(db, rows)
+    db.commit()
+    invalidate_snapshot("student upload")
+
+    stored_riders = int(needs_bus.sum())
+    stored_walkers = len(df_analyzed) - stored_riders
+    return stored_walkers, stored_riders
+
+# Builds the optimization job result from pipeline results
+def optimization_response(filename, num_rows, results, stored_walkers, stored_riders, elbow_plot_path=None):
+    return {
+        "filename": filename,
+        "num_rows": num_rows,
+        "num_buses": results.get("num_bus", 0),
+        "bus_loads": results.get("bus_loads", []),
+        "overview": results.get("overview", []),
+        "route_details": results.get("route_details", []),
+        "map_path": results.get("map_path"),
+        "elbow": results.get("elbow"),
+        "elbow_plot_path": elbow_plot_path,
+        "stage_timings": results.get("stage_timings"),
+        "walkers_stored": stored_walkers,
+        "riders_stored": stored_riders
+    }
+
+# Queues the pipeline for an uploaded CSV; the job stores walkers & bus riders & draws the elbow chart (opt-in) when it finishes
+async def queue_optimization(file: UploadFile, num_bus: int, bus_capacity: int, elbow_plot: bool, warm_start: bool, db: Session):
+    contents = await file.read()
+    try:
+        df = read_students_csv(contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Seeds the VRP with the published run's routes (opt-in)
+    previous_routes = get_published_route_coords(db) if warm_start else None
+    filename = file.filename
+    num_rows = len(df)
+
+    # Runs in the API process once the worker is done --> students are stored with the API's DB session
+    def store_results(results):
+        with session_scope() as db_session:
+            stored_walkers, stored_riders = store_analyzed_students(db_session, results)
+
+        elbow = results.get("elbow")
+        elbow_plot_path = None
+        if elbow_plot and elbow:
+            elbow_plot_path = os.path.join("assets", "elbow", f"upload_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.png")
+            render_elbow_plot(elbow["k_values"], elbow["inertias"], elbow["optimal_k"], elbow_plot_path)
+        return optimization_response(filename, num_rows, results, stored_walkers, stored_riders, elbow_plot_path)
+
+    job_id = submit_job(
+        {
+            "df": df,
+            "school_coords": SCHOOL_COORDS,
+            "bus_capacity": int(bus_capacity),
+            "num_bus": int(num_bus),
+            "safe_walk_miles": SAFE_WALK_MILES,
+            "generate_map": True,
+            "precompute": True,
+            "previous_routes": previous_routes
+        },
+        on_complete=store_results
+    )
+    return {"job_id": job_id, "status": "queued", "num_rows": num_rows}
+
+# Queues an optimization of the uploaded CSV & returns a job id right away (poll /jobs/{job_id} for progress)
+@app.post("/jobs/optimize", status_code=status.HTTP_202_ACCEPTED)
+async def submit_optimization_job(file: UploadFile = File(...), num_bus: int = Form(60), bus_capacity: int = Form(45), elbow_plot: bool = Form(False), warm_start: bool = Form(False), db: Session = Depends(get_db)):
+    return await queue_optimization(file, num_bus, bus_capacity, elbow_plot, warm_start, db)
+
+# Older upload endpoint, kept for existing clients: now queues the same job as /jobs/optimize & returns its id instead of the result
+@app.post("/upload_csv", status_code=status.HTTP_202_ACCEPTED)
+async def upload_csv(file: UploadFile = File(...), num_bus: int = Form(60), bus_capacity: int = Form(45), elbow_plot: bool = Form(False), warm_start: bool = Form(False), db: Session = Depends(get_db)):
+    return await queue_optimization(file, num_bus, bus_capacity, elbow_plot, warm_start, db)
+
+# Returns job status, current pipeline stage, & timings of the stages run so far
+@app.get("/jobs/{job_id}")
+def get_optimization_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Returns the optimization result once the job is done
+@app.get("/jobs/{job_id}/result")
+def get_optimization_job_result(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job['status']}")
+    return get_job_result(job_id)
 
 # Returns the student's current bus assignment & stop info for the published run (or indicates it's a walker)
 @app.get("/student/{student_id}")
 def get_student_route(student_id: str, db: Session = Depends(get_db)):
+    # Assigned students are answered from the published snapshot's index without touching the database
+    snapshot = get_published_snapshot(db)
+    entry = snapshot["students"].get(student_id)
+    if entry:
+        return {
+            "student_id": student_id,
+            "name": entry["name"],
+            "bus_number": entry["bus_number"],
+            "pickup_time": entry["pickup_time"],
+            "stop_location": entry["stop"],
+            "route_map_path": entry["route_map_path"]
+        }
+
     student = db.query(Student).filter(Student.student_id == student_id).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
-    
-    # Gets published run
-    published_run = db.query(OptimizationRun).filter_by(is_published=True).first()
-    if not published_run:
-        return {
-            "student_id": student.student_id,
-            "name": student.name,
-            "bus_number": None,
-            "pickup_time": None,
-            "stop_location": None,
-            "route_map_path": None,
-            "message": "No published route plan available"
-        }
-    
-    # Gets student's assignment for published run
-    assignment = db.query(StudentAssignment).filter_by(
-        student_id=student_id,
-        run_id=published_run.run_id
-    ).first()
-    
-    if not assignment:
-        return {
-            "student_id": student.student_id,
-            "name": student.name,
-            "bus_number": None,
-            "pickup_time": None,
-            "stop_location": None,
-            "route_map_path": None,
-            "message": "Student is a walker (no bus assignment)"
-        }
-    
+
     return {
         "student_id": student.student_id,
         "name": student.name,
-        "bus_number": assignment.route.bus_number,
-        "pickup_time": assignment.pickup_time.isoformat() if assignment.pickup_time else None,
-        "stop_location": {
-            "latitude": float(assignment.stop.latitude),
-            "longitude": float(assignment.stop.longitude),
-            "address": assignment.stop.address
-        },
-        "route_map_path": assignment.route.map_path
+        "bus_number": None,
+        "pickup_time": None,
+        "stop_location": None,
+        "route_map_path": None,
+        "message": "No published route plan available" if snapshot["run_id"] is None else "Student is a walker (no bus assignment)"
     }
 
-    try:
-        # This will try to create a database session
-        db = next(get_db())
-        db.close()
-        return {"status": "Database connection successful"}
-    except Exception as e:
-        return {"status": "Database connection failed", "error": str(e)}
-    
-def get_address_from_coordinates(lat, lon, api):
-    try:
-        # Uses Google Geocoding API to get address from lat/lon
-        url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={api}"
-       
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
-    
-        if data["status"] == "OK":
-            address = data["results"][0]["formatted_address"]
-            return address
-        elif data["status"] == "OVER_QUERY_LIMIT":
-            print("Google API rate limit exceeded!")
-            return "Address unavailable (rate limit)"
-        elif data["status"] == "REQUEST_DENIED":
-            print(f"API request denied: {data.get('error_message', 'No error message')}")
-            return "Address unavailable (API denied)"
-        else:
-            print(f"Geocoding failed with status: {data['status']}")
-            return f"Address unavailable ({data['status']})"
-    except Exception as e:
-        print(f"Geocoding error: {str(e)}")
-        return "Address unavailable (error)"
-
 # Saves completed optimization run, including routes, stops, & student assignments
 @app.post("/save_run")
-def save_run(run_data: RunPayload, db: Session = Depends(get_db)):
+def save_run(run_data: RunPayload, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     try:
        
-        # Checks first route
-        if run_data.route_details:
-            first_route = run_data.route_details[0]
-        else:
+        if not run_data.route_details:
             print("NO ROUTE DETAILS IN PAYLOAD")
-        
-
-        
-        # Saves the run
-        new_run = OptimizationRun(
-            timestamp=datetime.utcnow(),
-            is_published=False,
-            total_students_uploaded=run_data.total_students_uploaded,
-            total_walkers=run_data.total_walkers,
-            total_bus_riders=run_data.total_bus_riders,
-            buses_needed=run_data.buses_needed,
-            name=run_data.name,
-            overview_json=run_data.overview if hasattr(run_data, "overview") else None,
-            map_path=run_data.map_path if hasattr(run_data, "map_path") else None
-        )
-        db.add(new_run)
-        db.commit()
-        db.refresh(new_run)
-
-        student_count = 0
-        
-        # Saves routes
-        for route_idx, route in enumerate(run_data.route_details):
-            
-            db_route = Route(
-                run_id=new_run.run_id,
-                bus_number=route.bus_number,
-                total_students=route.total_students,
-                total_distance_km=route.total_distance_km,
-                estimated_duration_hr=route.estimated_duration_hr,
-                map_path=getattr(route, "map_path", None)
-            )
-            db.add(db_route)
-            db.flush()
-         
 
-            # Saves stops
-            for stop_idx, stop in enumerate(route.stops):
-                
-                address = get_address_from_coordinates(stop.latitude, stop.longitude, GOOGLE_API_KEY)
-               
-                db_stop = Stop(
-                    route_id=db_route.route_id,
-                    latitude=stop.latitude,
-                    longitude=stop.longitude,
-                    sequence_number=stop.sequence_number,
-                    address=address
-                )
-                db.add(db_stop)
-                db.flush()
-
-                # Saves students & creates assignments
-                for student_idx, student in enumerate(stop.students):
-                  
-                    pickup_time = None
-                    if student.pickup_time:
-                        try:
-                            pickup_time = datetime.fromisoformat(student.pickup_time).time()
-                        except:
-                            pickup_time = None
-
-                    # Checks if student exists in students table
-                    db_student = db.query(Student).filter_by(student_id=student.student_id).first()
-                    
-                    if not db_student:
-                        # Creates new student (only basic info, no assignment fields)
-                        db_student = Student(
-                            student_id=student.student_id,
-                            name=student.name,
-                            home_latitude=student.latitude,
-                            home_longitude=student.longitude,
-                        )
-                        db.add(db_student)
-                        db.flush()
-                    else:
-                        # Updates student basic info if needed
-                        db_student.name = student.name
-                        db_student.home_latitude = student.latitude
-                        db_student.home_longitude = student.longitude
-                    
-                    # Creates assignment linking student to this run/route/stop
-                    assignment = StudentAssignment(
-                        student_id=student.student_id,
-                        run_id=new_run.run_id,
-                        route_id=db_route.route_id,
-                        stop_id=db_stop.stop_id,
-                        pickup_time=pickup_time
-                    )
-                    db.add(assignment)
-                    student_count += 1
+        # Saves the run, routes, stops, students & assignments with bulk statements in one transaction
+        run_id, student_count = insert_run(db, run_data)
 
-        
         if student_count == 0:
             print("WARNING: NO STUDENTS WERE SAVED")
         
         db.commit()
+
+        # Student names & homes are shared across runs, so the published snapshot may have changed too
+        invalidate_snapshot("save_run")
+
+        # Geocodes stops after the response is sent (cached addresses, then batched lookups)
+        background_tasks.add_task(fill_run_addresses, run_id)
         
         return {
             "message": "Run saved successfully",
-            "run_id": new_run.run_id,
-            "students_saved": student_count
+            "run_id": run_id,
+            "students_saved": student_count,
+            "addresses_complete": not any(route.stops for route in run_data.route_details)
         }
 
     except Exception as e:
@@ -393,6 +316,149 @@ def save_run(run_data: RunPayload, db: Session = Depends(get_db)):
         print(traceback.format_exc())
         return {"error": str(e), "traceback": traceback.format_exc()}
 
+# get_run reports pickup times as "HH:MM:SS" while save_run parses full ISO datetimes
+def as_pickup_datetime(pickup_time):
+    if not pickup_time:
+        return ""
+    return pickup_time if "T" in pickup_time else f"1970-01-01T{pickup_time}"
+
+# Applies roster changes (adds, removes, moves) to a saved run & saves the result as a new run without rerunning the pipeline
+@app.post("/reoptimize_run/{run_id}")
+def reoptimize_run(run_id: int, changes: RosterDeltaPayload, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    run = db.query(OptimizationRun).filter(OptimizationRun.run_id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    try:
+        current = get_run(run_id, db)
+        routes = [
+            {
+                "bus_number": route["bus_number"],
+                "total_distance_km": route["total_distance_km"],
+                "estimated_duration_hr": route["estimated_duration_hr"],
+                "map_path": route["map_path"],
+                "stops": route["stops"]
+            }
+            for route in current["routes"]
+        ]
+
+        # Same walk threshold the pipeline uses (straight line distance to school)
+        safe_walk_km = (SAFE_WALK_MILES / 2.7) * 1.60934
+        routes, summary = apply_roster_changes(
+            routes,
+            {
+                "adds": [a.dict() for a in changes.adds],
+                "removes": changes.removes,
+                "moves": [m.dict() for m in changes.moves]
+            },
+            school_coords=SCHOOL_COORDS,
+            safe_walk_km=safe_walk_km,
+            bus_capacity=changes.bus_capacity
+        )
+
+        # Students that weren't riders of the base run were walkers
+        rider_ids = {student["student_id"] for route in current["routes"] for stop in route["stops"] for student in stop["students"]}
+        add_ids = {a.student_id for a in changes.adds}
+        new_walkers = set(summary["new_walkers"])
+        removed_walkers = len([sid for sid in changes.removes if sid not in rider_ids])
+        # Walkers gained: adds & riders who moved within walking distance (walkers who moved & still walk are already counted)
+        gained_walkers = len([sid for sid in new_walkers if sid in add_ids or sid in rider_ids])
+        # Walkers lost: walkers who moved out to bus distance
+        lost_walkers = len([m.student_id for m in changes.moves if m.student_id not in rider_ids and m.student_id not in new_walkers])
+        moved_to_walk = len([sid for sid in new_walkers if sid in rider_ids])
+        total_walkers = max(0, (run.total_walkers or 0) + gained_walkers - lost_walkers - removed_walkers)
+        total_riders = sum(route["total_students"] for route in routes)
+
+        payload = RunPayload(
+            name=changes.name or f"{run.name} (updated)",
+            total_students_uploaded=total_riders + total_walkers,
+            total_walkers=total_walkers,
+            total_bus_riders=total_riders,
+            buses_needed=len(routes),
+            overview=refresh_overview(run.overview_json, routes, total_walkers),
+            elbow=run.elbow_json,
+            # The base run's maps show its old routes & stops, so the new run is saved without maps
+            map_path=None,
+            route_details=[
+                {
+                    "bus_number": route["bus_number"],
+                    "total_students": route["total_students"],
+                    "total_distance_km": route["total_distance_km"],
+                    "estimated_duration_hr": route["estimated_duration_hr"],
+                    "map_path": None,
+                    "stops": [
+                        {
+                            "latitude": stop["latitude"],
+                            "longitude": stop["longitude"],
+                            "sequence_number": stop["sequence_number"],
+                            "students": [
+                                {
+                                    "student_id": student["student_id"],
+                                    "name": student["name"],
+                                    "pickup_time": as_pickup_datetime(student.get("pickup_time")),
+                                    "latitude": student["latitude"],
+                                    "longitude": student["longitude"]
+                                }
+                                for student in stop["students"]
+                            ]
+                        }
+                        for stop in route["stops"]
+                    ]
+                }
+                for route in routes
+            ]
+        )
+
+        # Updates walker status of every added or moved student so student lookups match the new run (committed together with it by save_run)
+        # Students placed on a route become riders; insert_run only refreshes name & home location of existing students
+        deltas = {d.student_id: d for d in changes.adds + changes.moves}
+        placed_ids = [s["student_id"] for route in routes for stop in route["stops"] for s in stop["students"] if s["student_id"] in deltas]
+        if placed_ids:
+            db.query(Student).filter(Student.student_id.in_(placed_ids)).update(
+                {Student.is_walker: False, Student.walking_distance_km: None}, synchronize_session=False
+            )
+
+        for student_id in new_walkers:
+            delta = deltas[student_id]
+            walking_distance = round(distance_to_school_km(delta.latitude, delta.longitude, SCHOOL_COORDS), 2)
+            db_student = db.query(Student).filter_by(student_id=student_id).first()
+            if db_student:
+                db_student.home_latitude = delta.latitude
+                db_student.home_longitude = delta.longitude
+                db_student.is_walker = True
+                db_student.walking_distance_km = walking_distance
+            else:
+                db.add(Student(
+                    student_id=student_id,
+                    name=delta.name or student_id,
+                    home_latitude=delta.latitude,
+                    home_longitude=delta.longitude,
+                    is_walker=True,
+                    walking_distance_km=walking_distance
+                ))
+
+        saved = save_run(payload, background_tasks, db)
+        if "error" in saved:
+            raise HTTPException(status_code=500, detail=saved["error"])
+
+        return {
+            "message": f"Run {run_id} re-optimized",
+            "base_run_id": run_id,
+            "run_id": saved["run_id"],
+            "students_saved": saved["students_saved"],
+            "moved_to_walk": moved_to_walk,
+            **summary
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        import traceback
+        print(f"ERROR in reoptimize_run: {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to re-optimize run: {str(e)}")
+
 # Stores all students from CSV, regardless of bus assignment
 @app.post("/store_all_students")
 async def store_all_students(file: UploadFile = File(...), db: Session = Depends(get_db)):
@@ -432,6 +498,7 @@ async def store_all_students(file: UploadFile = File(...), db: Session = Depends
                 stored_count += 1
         
         db.commit()
+        invalidate_snapshot("student upload")
         
         total_in_db = db.query(Student).count()
         
@@ -449,74 +516,89 @@ async def store_all_students(file: UploadFile = File(...), db: Session = Depends
         print(traceback.format_exc())
         return {"error": str(e)}
     
-# Retrieves currently published run with route & stop details
-@app.get("/get_published_run")
-def get_published_run(db: Session = Depends(get_db)):
-    run = db.query(OptimizationRun).filter_by(is_published=True).first()
-    if not run:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active run found")
-
-    try:
-        routes_data = []
-        for route in run.routes:
-            stops_data = []
-            for stop in route.stops:
-                # Gets assignments for this stop
-                assignments = db.query(StudentAssignment).filter_by(
-                    run_id=run.run_id,
-                    stop_id=stop.stop_id
-                ).all()
-                
-                students_data = []
-                for assignment in assignments:
-                    students_data.append({
-                        "student_id": assignment.student.student_id,
-                        "name": assignment.student.name,
-                        "pickup_time": assignment.pickup_time.isoformat() if assignment.pickup_time else None,
-                        "latitude": float(assignment.student.home_latitude),
-                        "longitude": float(assignment.student.home_longitude)
-                    })
-                
-                stops_data.append({
-                    "stop_id": stop.stop_id,
-                    "address": stop.address,
-                    "latitude": float(stop.latitude),
-                    "longitude": float(stop.longitude),
-                    "sequence_number": stop.sequence_number,
-                    "students": students_data
-                })
-            
-            routes_data.append({
-                "route_id": route.route_id,
-                "bus_number": route.bus_number,
-                "stops": stops_data,
-                "total_students": route.total_students,
-                "total_distance_km": route.total_distance_km,
-                "estimated_duration_hr": route.estimated_duration_hr,
-                "map_path": route.map_path
-            })
+# Serializes a run the way /get_published_run returns it
+def serialize_published_run(db: Session, run: OptimizationRun):
+    routes_data = []
+    for route, stops_data in load_run_routes(db, run.run_id):
+        routes_data.append({
+            "route_id": route.route_id,
+            "bus_number": route.bus_number,
+            "stops": stops_data,
+            "total_students": route.total_students,
+            "total_distance_km": route.total_distance_km,
+            "estimated_duration_hr": route.estimated_duration_hr,
+            "map_path": route.map_path
+        })
 
-        return {
-            "run_id": run.run_id,
-            "name": run.name,
-            "timestamp": run.timestamp,
-            "buses_needed": run.buses_needed,
-            "total_students_uploaded": run.total_students_uploaded,
-            "total_walkers": run.total_walkers,
-            "total_bus_riders": run.total_bus_riders,
-            "overview": run.overview_json or [],
-            "route_details": routes_data,
-            "map_path": run.map_path
-        }
+    return {
+        "run_id": run.run_id,
+        "name": run.name,
+        "timestamp": run.timestamp,
+        "buses_needed": run.buses_needed,
+        "total_students_uploaded": run.total_students_uploaded,
+        "total_walkers": run.total_walkers,
+        "total_bus_riders": run.total_bus_riders,
+        "overview": run.overview_json or [],
+        "route_details": routes_data,
+        "addresses_complete": all(stop["address"] is not None for route in routes_data for stop in route["stops"]),
+        "map_path": run.map_path
+    }
 
+# Maps student_id --> bus, stop, pickup time & map path of a serialized published run
+def build_student_index(published_run):
+    index = {}
+    for route in published_run["route_details"]:
+        for stop in route["stops"]:
+            for student in stop["students"]:
+                index[student["student_id"]] = {
+                    "name": student["name"],
+                    "run_id": published_run["run_id"],
+                    "route_id": route["route_id"],
+                    "bus_number": route["bus_number"],
+                    "pickup_time": student["pickup_time"],
+                    "stop": {
+                        "latitude": stop["latitude"],
+                        "longitude": stop["longitude"],
+                        "address": stop["address"]
+                    },
+                    "route_map_path": route["map_path"]
+                }
+    return index
+
+# Returns the cached published run snapshot (with its student index), building it from the database on a miss
+def get_published_snapshot(db: Session):
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    version = snapshot_version()
+    run = db.query(OptimizationRun).filter_by(is_published=True).first()
+    if run:
+        published_run = serialize_published_run(db, run)
+        snapshot = make_snapshot(run.run_id, published_run, students=build_student_index(published_run))
+    else:
+        snapshot = empty_snapshot(students={})
+    store_snapshot(snapshot, version)
+    return snapshot
+
+# Retrieves currently published run with route & stop details (served from the snapshot cache, 304 when the ETag matches)
+@app.get("/get_published_run")
+def get_published_run(request: Request, db: Session = Depends(get_db)):
+    try:
+        snapshot = get_published_snapshot(db)
     except Exception as e:
         print(f"Unexpected error in get_published_run: {e}")
         raise HTTPException(status_code=500, detail="Unexpected server error")
 
+    if snapshot["run_id"] is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active run found")
+    return snapshot_response(snapshot, request)
+
 # Lists all saved optimization runs with summary info
 @app.get("/get_all_runs")
 def get_all_runs(db: Session = Depends(get_db)):
     runs = db.query(OptimizationRun).all()
+    stop_counts = address_counts(db)
     return [
         {
             "run_id": run.run_id,
@@ -526,7 +608,8 @@ def get_all_runs(db: Session = Depends(get_db)):
             "total_students_uploaded": run.total_students_uploaded,
             "total_walkers": run.total_walkers,
             "total_bus_riders": run.total_bus_riders,
-            "is_published": run.is_published
+            "is_published": run.is_published,
+            "addresses_complete": stop_counts.get(run.run_id, (0, 0))[0] == stop_counts.get(run.run_id, (0, 0))[1]
         }
         for run in runs
     ]
@@ -540,6 +623,7 @@ def publish_run(run_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Run not found")
     run.is_published = True
     db.commit()
+    invalidate_snapshot("publish")
     return {"message": f"Run {run_id} published"}
 
 # Retrieves a specific run by ID with full details
@@ -550,34 +634,7 @@ def get_run(run_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Run not found")
 
     routes_data = []
-    for route in run.routes:
-        stops_data = []
-        for stop in route.stops:
-            # Gets assignments for this stop in this specific run
-            assignments = db.query(StudentAssignment).filter_by(
-                run_id=run_id,
-                stop_id=stop.stop_id
-            ).all()
-            
-            students_data = []
-            for assignment in assignments:
-                students_data.append({
-                    "student_id": assignment.student.student_id,
-                    "name": assignment.student.name,
-                    "pickup_time": assignment.pickup_time.isoformat() if assignment.pickup_time else None,
-                    "latitude": float(assignment.student.home_latitude),
-                    "longitude": float(assignment.student.home_longitude)
-                })
-            
-            stops_data.append({
-                "stop_id": stop.stop_id,
-                "address": stop.address,
-                "latitude": float(stop.latitude),
-                "longitude": float(stop.longitude),
-                "sequence_number": stop.sequence_number,
-                "students": students_data
-            })
-        
+    for route, stops_data in load_run_routes(db, run_id):
         routes_data.append({
             "route_id": route.route_id,
             "bus_number": route.bus_number,
@@ -592,9 +649,42 @@ def get_run(run_id: int, db: Session = Depends(get_db)):
         "run_id": run.run_id,
         "routes": routes_data,
         "overview": run.overview_json,
+        "stage_timings": run.stage_timings_json,
+        "addresses_complete": all(stop["address"] is not None for route in routes_data for stop in route["stops"]),
         "map_path": run.map_path
     }
 
+# Reports how many of a run's stops have their address filled (admins can publish before it completes)
+@app.get("/runs/{run_id}/address_status")
+def get_address_status(run_id: int, db: Session = Depends(get_db)):
+    run = db.query(OptimizationRun).filter(OptimizationRun.run_id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    total_stops, resolved_stops = address_counts(db, [run_id]).get(run_id, (0, 0))
+    return {
+        "run_id": run_id,
+        "total_stops": total_stops,
+        "resolved_stops": resolved_stops,
+        "addresses_complete": resolved_stops == total_stops
+    }
+
+# Draws (once) & returns the elbow method chart stored on a run
+@app.get("/elbow_plot/{run_id}")
+def get_elbow_plot(run_id: int, db: Session = Depends(get_db)):
+    run = db.query(OptimizationRun).filter(OptimizationRun.run_id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not run.elbow_json:
+        raise HTTPException(status_code=404, detail="No elbow data stored for this run")
+
+    output_path = os.path.join("assets", "elbow", f"run_{run_id}.png")
+    if not os.path.exists(output_path):
+        elbow = run.elbow_json
+        render_elbow_plot(elbow["k_values"], elbow["inertias"], elbow["optimal_k"], output_path)
+
+    return FileResponse(output_path, media_type="image/png")
+
 # Retrieves a specific route by ID with full details
 @app.get("/get_route/{route_id}")
 def get_route_details(route_id: int, db: Session = Depends(get_db)):
@@ -646,6 +736,7 @@ def delete_run(run_id: int, db: Session = Depends(get_db)):
         # Deletes the run (CASCADE will handle assignments, routes, stops)
         db.delete(run)
         db.commit()
+        invalidate_snapshot("delete")
         
         return {
             "message": f"Run {run_id} deleted successfully",
@@ -734,8 +825,7 @@ def save_feedback(feedback: dict = Body(...), db: Session = Depends(get_db)):
 
 # Stores real-time bus location updates from drivers (currently simulated)
 @app.post("/update-location")
-def update_location(data: LocationUpdate):
-    db = SessionLocal()
+def update_location(data: LocationUpdate, db: Session = Depends(get_db)):
     new_entry = BusLocation(
         bus_number=data.bus_number,
         latitude=data.latitude,
@@ -764,6 +854,11 @@ def get_latest_bus_location(bus_number: str, db: Session = Depends(get_db)):
         "timestamp": bus.timestamp.isoformat()
     }
 
+# Connection pool settings, current usage & checkout/wait counters of this API process (for sizing Postgres connections)
+@app.get("/db_pool_stats")
+def get_db_pool_stats():
+    return pool_metrics()
+
 # Retrieves all feedback, adjusting details based on whether the run was published
 @app.get("/feedback/all")
 def get_all_feedback(db: Session = Depends(get_db)):
@@ -841,26 +936,13 @@ def get_current_trip(student_id: str, db: Session = Depends(get_db)):
             "message": "Student is a walker (no bus assignment)"
         }
 
-    # Gets published optimization run
-    published_run = db.query(OptimizationRun).filter_by(is_published=True).first()
-    if not published_run:
+    # Looks up the assignment in the published snapshot's student index
+    snapshot = get_published_snapshot(db)
+    if snapshot["run_id"] is None:
         raise HTTPException(status_code=404, detail="No published run found")
 
-    # Finds the student's assignment for this run
-    assignment = db.query(StudentAssignment).filter_by(
-        student_id=student_id,
-        run_id=published_run.run_id
-    ).first()
-    
-    if not assignment:
-        if student.is_walker:
-            return {
-                "student_id": student.student_id,
-                "name": student.name,
-                "is_walker": True,
-                "message": "Student is a walker (no bus assignment)"
-            }
-        
+    entry = snapshot["students"].get(student_id)
+    if not entry:
         return {
             "student_id": student.student_id,
             "name": student.name,
@@ -868,24 +950,16 @@ def get_current_trip(student_id: str, db: Session = Depends(get_db)):
             "message": "Student not assigned to a bus for this run"
         }
 
-    # Gets route & stop info
-    route = db.query(Route).filter(Route.route_id == assignment.route_id).first()
-    stop = db.query(Stop).filter(Stop.stop_id == assignment.stop_id).first()
-
     return {
         "student_id": student.student_id,
         "name": student.name,
         "is_walker": False,
-        "bus_number": route.bus_number if route else None,
-        "route_id": route.route_id if route else None,  
-        "pickup_time": assignment.pickup_time.isoformat() if assignment.pickup_time else None,
-        "stop": {
-            "latitude": float(stop.latitude) if stop else None,
-            "longitude": float(stop.longitude) if stop else None,
-            "address": stop.address if stop else None
-        },
-        "route_map_path": route.map_path if route else None,
-        "run_id": published_run.run_id  
+        "bus_number": entry["bus_number"],
+        "route_id": entry["route_id"],
+        "pickup_time": entry["pickup_time"],
+        "stop": entry["stop"],
+        "route_map_path": entry["route_map_path"],
+        "run_id": entry["run_id"]
     }
 
 # Creates a new admin account with hashed password
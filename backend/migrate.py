@@ -0,0 +1,83 @@
+'''
+    - Brings an existing database up to the current db_models schema (run with: python migrate.py)
+    - Creates missing tables, adds columns added to models since the tables were created (nullable), & creates missing indexes
+    - Unpublishes all but the newest published run before creating the single published run index
+    - Safe to run repeatedly (every step checks what already exists)
+'''
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from database import Base, engine
+from db_models import OptimizationRun  # importing db_models registers every model on Base.metadata
+
+
+# Adds model columns that are missing from existing tables --> list of "table.column"
+def add_missing_columns(bind: Engine) -> list:
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+# Keeps only the most recent published run published (needed before the unique published index can be created)
+def fix_duplicate_published(bind: Engine) -> list:
+    with bind.begin() as conn:
+        published = [row[0] for row in conn.execute(
+            text(f"SELECT run_id FROM {OptimizationRun.__tablename__} WHERE is_published = :published ORDER BY run_id DESC"),
+            {"published": True}
+        )]
+        extra = published[1:]
+        for run_id in extra:
+            conn.execute(
+                text(f"UPDATE {OptimizationRun.__tablename__} SET is_published = :published WHERE run_id = :run_id"),
+                {"published": False, "run_id": run_id}
+            )
+    return extra
+
+# Creates model indexes that don't exist yet --> list of index names
+def create_missing_indexes(bind: Engine) -> list:
+    inspector = inspect(bind)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind, checkfirst=True)
+            # ddl_if can skip an index on this dialect, so only report ones that now exist
+            if index.name in {i["name"] for i in inspect(bind).get_indexes(table.name)}:
+                created.append(index.name)
+    return created
+
+
+def migrate(bind: Engine = engine):
+    Base.metadata.create_all(bind)
+
+    added = add_missing_columns(bind)
+    for name in added:
+        print(f"Added column {name}")
+
+    unpublished = fix_duplicate_published(bind)
+    if unpublished:
+        print(f"Unpublished runs {unpublished} (only one run can be published)")
+
+    created = create_missing_indexes(bind)
+    for name in created:
+        print(f"Created index {name}")
+
+    print(f"Migration complete: {len(added)} columns added, {len(created)} indexes created")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,80 +1,141 @@
 '''
     - Handles clustering of student locations to determine optimal bus stop locations using machine learning (KMeans clustering)
     - Ensures each stuent is assigned to a stop within a maximum walking distance
-    - Allows visualizaition of the elbow method for selecting optimal number of clusters & how it's split to ensure student comfort
+    - Returns the elbow method inertia series so the chart can be drawn later (see models/plots.py)
 '''
 
-from sklearn.cluster import KMeans
-from kneed import KneeLocator
-from sklearn.metrics.pairwise import haversine_distances
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import numpy as np
 import pandas as pd
-from typing import List, Tuple
-import matplotlib.pyplot as plt
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
 import math
-    
 
-# Computes optimal number of bus stops using KMeans & elbow method
-def find_optimal_clusters(coords: np.ndarray, k_range=range(1,31)) -> Tuple[int, KMeans, List[float]]:
-    # Stores inertia (total squared distance from points to cluster centers) values for each K
-    inertias = []
+EARTH_RADIUS_KM = 6371
+    
 
+# Fits a single KMeans (or MiniBatchKMeans) model for k clusters --> module level so it can run in a worker process
+def _fit_kmeans(coords: np.ndarray, k: int, minibatch: bool = False):
+    if minibatch:
+        return MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3).fit(coords)
+    return KMeans(n_clusters=k, random_state=42).fit(coords)
+
+# Fits every k in ks & returns {k: fitted model}, optionally spread across a process pool
+def _fit_many(coords: np.ndarray, ks: List[int], minibatch: bool, parallel: bool, max_workers=None) -> Dict[int, KMeans]:
+    if not parallel or len(ks) < 2:
+        return {k: _fit_kmeans(coords, k, minibatch) for k in ks}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        models = pool.map(_fit_kmeans, [coords] * len(ks), ks, [minibatch] * len(ks))
+        return dict(zip(ks, models))
+
+# Coarse-to-fine elbow search --> golden-section search over k on the distance below the chord between the end points
+# For a convex decreasing inertia curve that distance is unimodal, so only ~log(k) fits are needed instead of one per k
+def _search_elbow(coords: np.ndarray, ks: List[int], minibatch: bool) -> Dict[int, KMeans]:
+    models = {}
+
+    def fit(i):
+        k = ks[i]
+        if k not in models:
+            models[k] = _fit_kmeans(coords, k, minibatch)
+        return models[k].inertia_
+
+    lo, hi = 0, len(ks) - 1
+    first, last = fit(lo), fit(hi)
+    if hi < 2:
+        return models
+
+    # Height of the straight line between the first & last inertia minus the actual inertia at index i
+    def gap(i):
+        chord = first + (last - first) * (ks[i] - ks[0]) / (ks[-1] - ks[0])
+        return chord - fit(i)
+
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    while b - a > 2:
+        c = b - int(round((b - a) * ratio))
+        d = a + int(round((b - a) * ratio))
+        if c == d:
+            d = c + 1
+        if gap(c) >= gap(d):
+            b = d
+        else:
+            a = c
+
+    # Settles the last few candidates exactly
+    for i in range(a, b + 1):
+        fit(i)
+
+    return models
+
+# Picks elbow from sampled points --> KneeLocator when it finds one, otherwise the point farthest below the chord
+def _locate_elbow(ks: List[int], inertias: List[float]) -> int:
+    if len(ks) < 3:
+        return ks[0]
+
+    # kneed imports pyplot at module level, so it's only loaded once an elbow is actually needed
+    from kneed import KneeLocator
+    kneedle = KneeLocator(ks, inertias, curve='convex', direction='decreasing')
+    if kneedle.elbow is not None:
+        return int(kneedle.elbow)
+
+    first, last = inertias[0], inertias[-1]
+    gaps = [first + (last - first) * (k - ks[0]) / (ks[-1] - ks[0]) - inertia for k, inertia in zip(ks, inertias)]
+    return ks[int(np.argmax(gaps))]
 
-    # Finds optimal number of clusters for bus stops
-    for k in k_range:
-        kmeans = KMeans(n_clusters=k, random_state=42)
-        kmeans.fit(coords)
-        inertias.append(kmeans.inertia_)
 
-    # Uses KneeLocator to find point where rate of decrease in inertia sharply changes (elbow) --> Where adding more stops gives diminishing returns
-    kneedle = KneeLocator(k_range, inertias, curve='convex', direction='decreasing')
-    optimal_k = kneedle.elbow
+# Computes optimal number of bus stops using KMeans & elbow method
+# search="full" fits every k in order, "parallel" fits every k across a process pool, "bisection" only fits ~log(k) values of k
+# minibatch=True swaps KMeans for MiniBatchKMeans (much faster on large rider files, slightly noisier inertias)
+# In "bisection" mode k values that were never fitted are reported as None in the inertia list
+def find_optimal_clusters(
+    coords: np.ndarray,
+    k_range=range(1,31),
+    search: str = "full",
+    minibatch: bool = False,
+    max_workers=None
+) -> Tuple[int, KMeans, List[Optional[float]]]:
+    k_values = [k for k in k_range if k <= len(coords)]
+    if not k_values:
+        raise ValueError("Not enough bus riders to form any clusters")
+
+    # Stores fitted models for each K so the chosen one can be reused instead of refitted
+    if search == "full":
+        models = _fit_many(coords, k_values, minibatch, parallel=False)
+    elif search == "parallel":
+        models = _fit_many(coords, k_values, minibatch, parallel=True, max_workers=max_workers)
+    elif search == "bisection":
+        models = _search_elbow(coords, k_values, minibatch)
+    else:
+        raise ValueError(f"Unknown cluster search mode: {search}")
 
-    # Trains a KMeans model using optimal num of clusters --> model knows location of each cluster & which points belong to which cluster
-    kmeans_opt = KMeans(n_clusters=optimal_k, random_state=42).fit(coords)
+    # Stores inertia (total squared distance from points to cluster centers) values for each K
+    inertias = [models[k].inertia_ if k in models else None for k in k_range]
 
+    # Uses KneeLocator to find point where rate of decrease in inertia sharply changes (elbow) --> Where adding more stops gives diminishing returns
+    fitted_ks = sorted(models)
+    optimal_k = _locate_elbow(fitted_ks, [models[k].inertia_ for k in fitted_ks])
 
-    plt.plot(k_range, inertias, marker='o')
-    plt.axvline(optimal_k, color='red', linestyle='--', label=f'Elbow at k={optimal_k}')
-    plt.xticks(k_range)
-    plt.xlabel('Number of Clusters (k)')
-    plt.ylabel('Inertia')
-    plt.title('Elbow Method for Optimal k')
-    plt.legend()
-    plt.grid(True)
-    plt.savefig('assets/elbow_method.png', dpi=300, bbox_inches='tight')
-    plt.close()
+    # Reuses the model already trained with optimal num of clusters --> model knows location of each cluster & which points belong to which cluster
+    kmeans_opt = models[optimal_k]
+    print(f"Elbow at k={optimal_k} ({len(models)} KMeans fits, search={search})")
 
     return optimal_k, kmeans_opt, inertias
 
 # Generates a DataFrame of stops with coordinates, student counts,and optional school depot
 def create_stop_df(df, kmeans_model=None, school_coords=None):
-    # Gets unique stop IDs
-    stop_ids = df['assigned_stop_id'].unique()
-    
-    stops_data = []
-    
-    for stop_id in stop_ids:
-        # Gets all students assigned to this stop
-        students_at_stop = df[df['assigned_stop_id'] == stop_id]
-        
-        # Calculates centroid (mean of all student coordinates)
-        centroid_lat = students_at_stop['Latitude'].mean()
-        centroid_lon = students_at_stop['Longitude'].mean()
-        
-        # Gets student IDs for this stop
-        student_ids = students_at_stop['StudentID'].tolist()
-        
-        stops_data.append({
-            'stop_id': int(stop_id),
-            'original_stop_id': int(stop_id), 
-            'latitude': centroid_lat,
-            'longitude': centroid_lon,
-            'num_students': len(students_at_stop),
-            'student_ids': student_ids 
-        })
-    
-    stop_df = pd.DataFrame(stops_data)
+    # Calculates centroid (mean of all student coordinates), student count & student IDs for every stop in one grouped pass
+    # sort=False keeps stops in order of first appearance, like iterating over unique() did
+    stop_df = df.groupby('assigned_stop_id', sort=False).agg(
+        latitude=('Latitude', 'mean'),
+        longitude=('Longitude', 'mean'),
+        num_students=('StudentID', 'size'),
+        student_ids=('StudentID', list)
+    ).reset_index()
+
+    stop_df['stop_id'] = stop_df['assigned_stop_id'].astype(int)
+    stop_df['original_stop_id'] = stop_df['stop_id']
+    stop_df = stop_df[['stop_id', 'original_stop_id', 'latitude', 'longitude', 'num_students', 'student_ids']]
     
     # Adds school as a stop (depot)
     if school_coords:
@@ -90,54 +151,82 @@ def create_stop_df(df, kmeans_model=None, school_coords=None):
     
     return stop_df
 
+# Great circle distance (km) between paired arrays of lat/lon points
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
 # Splits clusters so every student is within a max distiance from their assigned stop
-def enforce_max_distance(df_bus, max_distance_km):
+# Only distances for students in clusters that were split are recomputed, & labels are written with array operations
+# Returns the updated DataFrame & a status dict reporting whether every student ended up within max_distance_km
+def enforce_max_distance(df_bus, max_distance_km, max_iter=50) -> Tuple[pd.DataFrame, dict]:
     new_df = df_bus.copy()
-    
-    while True:
-        # Computes current cluster centers
-        stop_centers = []
-        cluster_map = {} 
-        for new_idx, (stop_id, group) in enumerate(new_df.groupby('assigned_stop_id')):
-            stop_centers.append(group[['Latitude', 'Longitude']].mean().to_numpy())
-            cluster_map[stop_id] = new_idx
-        
-        centroids_rad = np.radians(np.array(stop_centers))
-        student_coords_rad = np.radians(new_df[['Latitude', 'Longitude']].to_numpy())
-        distances_rad = haversine_distances(student_coords_rad, centroids_rad)
-        
-        # Reindexes assigned_stop_id to match centroids
-        new_df['assigned_stop_id_reindexed'] = new_df['assigned_stop_id'].map(cluster_map)
-        new_df['distance_to_stop_km'] = distances_rad[np.arange(len(new_df)), new_df['assigned_stop_id_reindexed']] * 6371
+    coords = new_df[['Latitude', 'Longitude']].to_numpy(dtype=float)
+    labels = new_df['assigned_stop_id'].to_numpy(dtype=np.int64).copy()
 
-        # Finds clusters with students too far
-        problematic_clusters = [
-            stop_id for stop_id, group in new_df.groupby('assigned_stop_id')
-            if group['distance_to_stop_km'].max() > max_distance_km
-        ]
+    distances = np.zeros(len(labels))
+    changed = np.ones(len(labels), dtype=bool)
+    next_id = int(labels.max()) + 1 if len(labels) else 0
+    converged = len(labels) == 0
+    problematic_clusters = np.array([], dtype=np.int64)
+    iterations = 0
 
-        
-        if not problematic_clusters:
-            break
-        
-        # Splits each problematic cluster
-        max_existing_id = new_df['assigned_stop_id'].max() + 1
-        for stop_id in problematic_clusters:
-            group = new_df[new_df['assigned_stop_id'] == stop_id]
-            num_subclusters = max(2, math.ceil(group['distance_to_stop_km'].max() / max_distance_km))
+    while not converged and iterations < max_iter:
+        iterations += 1
 
-            # Reclusters into smaller subclusters
-            sub_coords = group[['Latitude', 'Longitude']].to_numpy()
-            kmeans_sub = KMeans(n_clusters=num_subclusters, random_state=42)
-            new_labels = kmeans_sub.fit_predict(sub_coords)
+        # Computes current cluster centers (empty ids left by earlier splits stay at 0 & are never looked up)
+        counts = np.bincount(labels, minlength=next_id)
+        safe_counts = np.maximum(counts, 1)
+        center_lat = np.bincount(labels, weights=coords[:, 0], minlength=next_id) / safe_counts
+        center_lon = np.bincount(labels, weights=coords[:, 1], minlength=next_id) / safe_counts
 
-            # Assigns new cluster IDs
-            for i, student_idx in enumerate(group.index):
-                new_df.at[student_idx, 'assigned_stop_id'] = max_existing_id + new_labels[i]
+        # Recomputes distances only for students whose cluster changed
+        idx = np.nonzero(changed)[0]
+        distances[idx] = _haversine_km(coords[idx, 0], coords[idx, 1], center_lat[labels[idx]], center_lon[labels[idx]])
 
-            max_existing_id += num_subclusters
+        # Finds clusters with students too far
+        max_per_cluster = np.zeros(next_id)
+        np.maximum.at(max_per_cluster, labels, distances)
+        problematic_clusters = np.nonzero(max_per_cluster > max_distance_km)[0]
 
+        if len(problematic_clusters) == 0:
+            converged = True
+            break
+        if iterations == max_iter:
+            break
 
-    new_df.drop(columns='assigned_stop_id_reindexed', inplace=True)
-    return new_df
+        # Groups students of problematic clusters together in one sort instead of one mask per cluster
+        members = np.nonzero(np.isin(labels, problematic_clusters))[0]
+        members = members[np.argsort(labels[members], kind='stable')]
+        cluster_ids, starts = np.unique(labels[members], return_index=True)
+        groups = np.split(members, starts[1:])
 
+        # Splits each problematic cluster
+        changed[:] = False
+        for stop_id, group in zip(cluster_ids, groups):
+            sub_coords = coords[group]
+            num_subclusters = max(2, math.ceil(max_per_cluster[stop_id] / max_distance_km))
+            num_subclusters = min(num_subclusters, len(np.unique(sub_coords, axis=0)))
+
+            # Reclusters into smaller subclusters & assigns new cluster IDs
+            new_labels = KMeans(n_clusters=num_subclusters, random_state=42).fit_predict(sub_coords)
+            labels[group] = next_id + new_labels
+            changed[group] = True
+            next_id += num_subclusters
+
+    new_df['assigned_stop_id'] = labels
+    new_df['distance_to_stop_km'] = distances
+
+    over_limit = int((distances > max_distance_km).sum())
+    status = {
+        "converged": converged,
+        "iterations": iterations,
+        "num_stops": int(len(np.unique(labels))),
+        "max_walk_km": float(distances.max()) if len(distances) else 0.0,
+        "students_over_limit": over_limit
+    }
+    if not converged:
+        print(f"WARNING: max walk not enforced after {iterations} iterations ({over_limit} students over {max_distance_km} km)")
+
+    return new_df, status
@@ -0,0 +1,273 @@
+'''
+    - Persists downloaded OSM road networks as compact numpy arrays so repeat runs skip the download & graph rebuild
+    - Reuses any cached graph whose bounding box contains the requested area (also lets the pipeline run offline)
+    - Downloads are centered on a grid point & padded, so runs whose center shifts a little (roster changes) still hit the same graph
+    - Cache hits return a StoredGraph over the memory-mapped arrays: routing builds its CSR matrix & snapping its BallTree straight from them
+    - A networkx graph is only rebuilt when something needs one (networkx distance engine, projected graphs) --> as_networkx
+    - Evicts least recently used graphs once the store grows past a size limit (graph directories missing from the index count too)
+    - index.json updates hold a file lock, so concurrent runs (JOB_WORKERS > 1 or several API processes) don't drop each other's entries
+'''
+
+import os
+import json
+import time
+import math
+import shutil
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+import numpy as np
+import networkx as nx
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, index updates are unlocked
+    fcntl = None
+
+
+GRAPH_CACHE_DIR = os.getenv("GRAPH_CACHE_DIR", os.path.join("cache", "graphs"))
+GRAPH_CACHE_MAX_MB = float(os.getenv("GRAPH_CACHE_MAX_MB", "500"))
+GRAPH_CACHE_GRID_M = float(os.getenv("GRAPH_CACHE_GRID_M", "1000"))
+GRAPH_CACHE_PAD_M = float(os.getenv("GRAPH_CACHE_PAD_M", "2000"))
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+ARRAY_NAMES = ("node_ids", "node_x", "node_y", "edge_u", "edge_v", "edge_length")
+
+# Keeps the last few graphs loaded in this process so back to back runs reuse the same object (& anything cached on it)
+_loaded_graphs = OrderedDict()
+_MAX_LOADED_GRAPHS = 2
+
+
+# Computes (north, south, east, west) box around a point, matching graph_from_point's dist in meters
+def bbox_from_point(center: Tuple[float, float], dist: float) -> Tuple[float, float, float, float]:
+    lat, lon = center
+    delta_lat = dist / 111320
+    delta_lon = dist / (111320 * math.cos(math.radians(lat)))
+    return lat + delta_lat, lat - delta_lat, lon + delta_lon, lon - delta_lon
+
+# Snaps a point to a grid with grid_m meter cells so nearby centers share one download
+def snap_to_grid(center: Tuple[float, float], grid_m: float = GRAPH_CACHE_GRID_M) -> Tuple[float, float]:
+    if grid_m <= 0:
+        return center
+    lat_step = grid_m / 111320
+    lat = round(center[0] / lat_step) * lat_step
+    lon_step = grid_m / (111320 * math.cos(math.radians(lat)))
+    return lat, round(center[1] / lon_step) * lon_step
+
+# Checks if inner box lies completely inside outer box
+def _bbox_contains(outer, inner) -> bool:
+    return outer[0] >= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] <= inner[3]
+
+def _read_index(cache_dir: str) -> Dict:
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"entries": []}
+
+# Writes index atomically so concurrent workers never read a half written file
+def _write_index(cache_dir: str, index: Dict):
+    tmp_path = os.path.join(cache_dir, f"{INDEX_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, INDEX_FILE))
+
+# Holds an exclusive lock on the cache's lock file while the index is read, changed & written back
+@contextmanager
+def _index_lock(cache_dir: str):
+    with open(os.path.join(cache_dir, LOCK_FILE), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Marks a cached graph as just used (LRU order for eviction)
+def _touch_entry(cache_dir: str, name: str):
+    with _index_lock(cache_dir):
+        index = _read_index(cache_dir)
+        for entry in index["entries"]:
+            if entry["path"] == name:
+                entry["last_used"] = time.time()
+        _write_index(cache_dir, index)
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+# Saves node coordinates & edge lengths (all the pipeline needs) as .npy files
+def save_graph_arrays(G: nx.MultiDiGraph, path: str) -> int:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+    node_pos = {node: i for i, node in enumerate(node_ids.tolist())}
+    node_x = np.array([G.nodes[n]['x'] for n in node_ids.tolist()], dtype=np.float64)
+    node_y = np.array([G.nodes[n]['y'] for n in node_ids.tolist()], dtype=np.float64)
+
+    # Stores edges as node positions (int32) --> ready to build a sparse adjacency matrix without another lookup
+    edges = list(G.edges(data='length', default=0.0))
+    edge_u = np.array([node_pos[u] for u, _, _ in edges], dtype=np.int32)
+    edge_v = np.array([node_pos[v] for _, v, _ in edges], dtype=np.int32)
+    edge_length = np.array([length for _, _, length in edges], dtype=np.float64)
+
+    for name, arr in zip(ARRAY_NAMES, (node_ids, node_x, node_y, edge_u, edge_v, edge_length)):
+        np.save(os.path.join(tmp_path, f"{name}.npy"), arr)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"crs": str(G.graph.get("crs", "epsg:4326"))}, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return _dir_size(path)
+
+# Loads saved arrays (memory mapped by default so only touched pages are read)
+def load_graph_arrays(path: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in ARRAY_NAMES}
+    with open(os.path.join(path, "meta.json")) as f:
+        arrays["crs"] = json.load(f)["crs"]
+    return arrays
+
+# Rebuilds a networkx graph with the attributes osmnx & routing rely on (node x/y, edge length, graph crs)
+def graph_from_arrays(arrays: Dict[str, np.ndarray]) -> nx.MultiDiGraph:
+    G = nx.MultiDiGraph(crs=arrays["crs"])
+    node_ids = np.asarray(arrays["node_ids"]).tolist()
+    G.add_nodes_from(
+        (node, {'x': x, 'y': y})
+        for node, x, y in zip(node_ids, np.asarray(arrays["node_x"]).tolist(), np.asarray(arrays["node_y"]).tolist())
+    )
+    G.add_edges_from(
+        (node_ids[u], node_ids[v], {'length': length})
+        for u, v, length in zip(np.asarray(arrays["edge_u"]).tolist(), np.asarray(arrays["edge_v"]).tolist(), np.asarray(arrays["edge_length"]).tolist())
+    )
+    return G
+
+
+# Graph loaded from the store without building a networkx graph (nodes & edges stay in the memory mapped arrays)
+# Has the .graph dict (crs, store_path & caches) that graph_to_csr, graph_node_index & node_coordinates work from
+class StoredGraph:
+    def __init__(self, path: str, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.graph = {"crs": arrays["crs"], "store_path": path}
+        self._networkx = None
+
+    def number_of_nodes(self) -> int:
+        return len(self.arrays["node_ids"])
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        if self._networkx is None:
+            self._networkx = graph_from_arrays(self.arrays)
+            self._networkx.graph["store_path"] = self.graph["store_path"]
+        return self._networkx
+
+# Returns a networkx graph for code that needs one (builds it once for a StoredGraph)
+def as_networkx(G) -> nx.MultiDiGraph:
+    return G.to_networkx() if isinstance(G, StoredGraph) else G
+
+# Memory mapped arrays of a graph saved in the store, opened once per graph
+def stored_arrays(G) -> Dict[str, np.ndarray]:
+    if "_arrays" not in G.graph:
+        G.graph["_arrays"] = G.arrays if isinstance(G, StoredGraph) else load_graph_arrays(G.graph["store_path"])
+    return G.graph["_arrays"]
+
+
+# Removes least recently used graphs until the store fits in max_bytes (never removes keep)
+def evict_graphs(cache_dir: str, max_bytes: float, keep: Optional[str] = None) -> list:
+    with _index_lock(cache_dir):
+        return _evict_graphs(cache_dir, max_bytes, keep)
+
+# evict_graphs for callers already holding the index lock
+def _evict_graphs(cache_dir: str, max_bytes: float, keep: Optional[str] = None) -> list:
+    index = _read_index(cache_dir)
+    entries = [e for e in index["entries"] if os.path.isdir(os.path.join(cache_dir, e["path"]))]
+    indexed = {e["path"] for e in entries}
+
+    # Graph directories the index lost track of are evictable too (oldest first by modification time)
+    orphans = [
+        {"path": name, "size_bytes": _dir_size(os.path.join(cache_dir, name)), "last_used": os.path.getmtime(os.path.join(cache_dir, name))}
+        for name in os.listdir(cache_dir)
+        if name not in indexed and not name.endswith(".tmp") and os.path.isdir(os.path.join(cache_dir, name))
+    ]
+    total = sum(e["size_bytes"] for e in entries + orphans)
+    evicted = []
+
+    for entry in sorted(entries + orphans, key=lambda e: e["last_used"]):
+        if total <= max_bytes:
+            break
+        if entry["path"] == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, entry["path"]), ignore_errors=True)
+        _loaded_graphs.pop(os.path.join(cache_dir, entry["path"]), None)
+        total -= entry["size_bytes"]
+        evicted.append(entry["path"])
+
+    index["entries"] = [e for e in entries if e["path"] not in evicted]
+    _write_index(cache_dir, index)
+    if evicted:
+        print(f"Evicted {len(evicted)} cached graphs from {cache_dir}")
+    return evicted
+
+
+# Returns road graph around center: a StoredGraph when a cached box contains the area, otherwise downloads & saves a padded box (networkx graph)
+def load_or_download_graph(
+    center: Tuple[float, float],
+    dist: float = 10000,
+    network_type: str = 'drive',
+    cache_dir: str = GRAPH_CACHE_DIR,
+    max_cache_mb: float = GRAPH_CACHE_MAX_MB
+):
+    os.makedirs(cache_dir, exist_ok=True)
+    bbox = bbox_from_point(center, dist)
+    index = _read_index(cache_dir)
+
+    # Picks the smallest cached box that contains the requested one
+    candidates = [
+        e for e in index["entries"]
+        if e["network_type"] == network_type and _bbox_contains(e["bbox"], bbox)
+        and os.path.isdir(os.path.join(cache_dir, e["path"]))
+    ]
+    if candidates:
+        entry = min(candidates, key=lambda e: (e["bbox"][0] - e["bbox"][1]) * (e["bbox"][2] - e["bbox"][3]))
+        path = os.path.join(cache_dir, entry["path"])
+        _touch_entry(cache_dir, entry["path"])
+
+        if path in _loaded_graphs:
+            _loaded_graphs.move_to_end(path)
+            print(f"Using in-memory road graph {entry['path']}")
+            return _loaded_graphs[path]
+
+        G = StoredGraph(path, load_graph_arrays(path))
+        print(f"Loaded cached road graph {entry['path']} ({G.number_of_nodes()} nodes, memory mapped)")
+    else:
+        # Downloads a padded box around the nearest grid point (pad of at least one grid cell keeps the requested box inside)
+        download_center = snap_to_grid(center)
+        download_dist = dist + max(GRAPH_CACHE_PAD_M, GRAPH_CACHE_GRID_M)
+        bbox = bbox_from_point(download_center, download_dist)
+        import osmnx as ox  # only needed on a cache miss (osmnx loads matplotlib.pyplot on import)
+        G = ox.graph_from_point(download_center, dist=download_dist, network_type=network_type)
+        name = f"{network_type}_{bbox[0]:.5f}_{bbox[1]:.5f}_{bbox[2]:.5f}_{bbox[3]:.5f}".replace("-", "m")
+        path = os.path.join(cache_dir, name)
+        # Saves & indexes under the lock so no concurrent eviction sees the new directory as an orphan
+        with _index_lock(cache_dir):
+            size = save_graph_arrays(G, path)
+            index = _read_index(cache_dir)
+            index["entries"] = [e for e in index["entries"] if e["path"] != name]
+            index["entries"].append({
+                "path": name,
+                "network_type": network_type,
+                "bbox": list(bbox),
+                "size_bytes": size,
+                "last_used": time.time()
+            })
+            _write_index(cache_dir, index)
+            _evict_graphs(cache_dir, max_cache_mb * 1024 * 1024, keep=name)
+        print(f"Saved road graph {name} ({size / 1024 / 1024:.1f} MB)")
+
+    G.graph["store_path"] = path
+    _loaded_graphs[path] = G
+    while len(_loaded_graphs) > _MAX_LOADED_GRAPHS:
+        _loaded_graphs.popitem(last=False)
+    return G
@@ -0,0 +1,223 @@
+'''
+    - Applies roster changes (adds, removes & moves of students) to a saved run without rerunning the full pipeline
+    - Reassigns touched students to existing stops within the walk limit & spare bus capacity
+    - Re-clusters only the students left over into new stops & inserts them into routes by cheapest insertion
+    - Route distances are updated by insertion/removal deltas on straight line distance times a road detour factor
+'''
+
+import copy
+import math
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from models.clustering import enforce_max_distance, create_stop_df
+
+EARTH_RADIUS_KM = 6371
+ROAD_FACTOR = 1.3
+AVERAGE_SPEED_KMH = 35
+
+
+# Great circle distance (km) between two lat/lon points
+def _haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+# Straight line distance (km) from a home to the school, like the pipeline's distance_to_school_km
+def distance_to_school_km(lat: float, lon: float, school_coords: Tuple[float, float]) -> float:
+    return _haversine_km((lat, lon), school_coords)
+
+# Estimated driving distance between two points
+def _road_km(a, b) -> float:
+    return _haversine_km(a, b) * ROAD_FACTOR
+
+# Coordinates of every point a bus visits, school first & last
+def _route_points(route: Dict, school_coords) -> List[Tuple[float, float]]:
+    return [school_coords] + [(s['latitude'], s['longitude']) for s in route['stops']] + [school_coords]
+
+def _route_load(route: Dict) -> int:
+    return sum(len(stop['students']) for stop in route['stops'])
+
+# Removes one stop from a route & returns the change in estimated distance
+def _remove_stop(route: Dict, stop_pos: int, school_coords) -> float:
+    points = _route_points(route, school_coords)
+    prev, stop, nxt = points[stop_pos], points[stop_pos + 1], points[stop_pos + 2]
+    route['stops'].pop(stop_pos)
+    return _road_km(prev, nxt) - _road_km(prev, stop) - _road_km(stop, nxt)
+
+# Finds cheapest (route, position) to insert a stop with num_students, respecting bus capacity
+def _cheapest_insertion(routes: List[Dict], stop_coords, num_students: int, bus_capacity: int, school_coords):
+    best = None
+    for r, route in enumerate(routes):
+        if _route_load(route) + num_students > bus_capacity:
+            continue
+        points = _route_points(route, school_coords)
+        for pos in range(len(points) - 1):
+            cost = _road_km(points[pos], stop_coords) + _road_km(stop_coords, points[pos + 1]) - _road_km(points[pos], points[pos + 1])
+            if best is None or cost < best[0]:
+                best = (cost, r, pos)
+    return best
+
+
+# Applies adds, removes & moves to a run's routes (as returned by get_run) & returns updated routes plus a summary
+# changes = {"adds": [{student_id, name, latitude, longitude}], "removes": [student_id], "moves": [{student_id, latitude, longitude}]}
+def apply_roster_changes(
+    routes: List[Dict],
+    changes: Dict,
+    school_coords: Tuple[float, float],
+    safe_walk_km: float,
+    max_walk_km: float = 1,
+    bus_capacity: int = 45
+) -> Tuple[List[Dict], Dict]:
+    routes = copy.deepcopy(routes)
+    touched = set()
+    distance_delta = {}
+
+    moves = {m['student_id']: m for m in changes.get('moves', [])}
+    removes = set(changes.get('removes', []))
+
+    # Takes removed & moved students out of their stops
+    known_students = {}
+    removed_riders = 0
+    for route in routes:
+        for stop in route['stops']:
+            kept = []
+            for student in stop['students']:
+                known_students[student['student_id']] = student
+                if student['student_id'] in removes or student['student_id'] in moves:
+                    touched.add(route['bus_number'])
+                    removed_riders += student['student_id'] in removes
+                else:
+                    kept.append(student)
+            stop['students'] = kept
+
+    # Students that need a place: adds (named by their id when no name is given) & moves (keep their name & pickup time)
+    candidates = [dict(a, name=a.get('name') or a['student_id'], pickup_time=a.get('pickup_time')) for a in changes.get('adds', [])]
+    for student_id, move in moves.items():
+        student = dict(known_students.get(student_id, {'student_id': student_id, 'name': move.get('name') or student_id, 'pickup_time': None}))
+        student.update(latitude=move['latitude'], longitude=move['longitude'])
+        if move.get('name'):
+            student['name'] = move['name']
+        candidates.append(student)
+
+    walkers, leftovers = [], []
+    reassigned = 0
+    all_stops = [(r, s) for r, route in enumerate(routes) for s in range(len(route['stops']))]
+    stop_coords = np.array([(routes[r]['stops'][s]['latitude'], routes[r]['stops'][s]['longitude']) for r, s in all_stops]).reshape(-1, 2)
+    loads = [_route_load(route) for route in routes]
+
+    for student in candidates:
+        home = (student['latitude'], student['longitude'])
+        if _haversine_km(home, school_coords) <= safe_walk_km:
+            walkers.append(student)
+            continue
+
+        # Nearest existing stop within the walk limit on a bus with a free seat
+        placed = False
+        if len(all_stops):
+            lat1, lon1 = np.radians(home)
+            lat2, lon2 = np.radians(stop_coords[:, 0]), np.radians(stop_coords[:, 1])
+            h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+            walk_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+            for i in np.argsort(walk_km):
+                if walk_km[i] > max_walk_km:
+                    break
+                r, s = all_stops[i]
+                if loads[r] < bus_capacity:
+                    routes[r]['stops'][s]['students'].append(student)
+                    loads[r] += 1
+                    touched.add(routes[r]['bus_number'])
+                    reassigned += 1
+                    placed = True
+                    break
+        if not placed:
+            leftovers.append(student)
+
+    # Drops stops nobody uses anymore
+    for route in routes:
+        for pos in range(len(route['stops']) - 1, -1, -1):
+            if not route['stops'][pos]['students']:
+                distance_delta[route['bus_number']] = distance_delta.get(route['bus_number'], 0) + _remove_stop(route, pos, school_coords)
+                touched.add(route['bus_number'])
+
+    # Re-clusters leftover students into new stops (same max walk rule as the full pipeline)
+    new_stops = 0
+    if leftovers:
+        df_left = pd.DataFrame({
+            'StudentID': [s['student_id'] for s in leftovers],
+            'Latitude': [s['latitude'] for s in leftovers],
+            'Longitude': [s['longitude'] for s in leftovers],
+            'assigned_stop_id': 0
+        })
+        df_left, _ = enforce_max_distance(df_left, max_walk_km)
+        by_id = {s['student_id']: s for s in leftovers}
+
+        for _, stop_row in create_stop_df(df_left).iterrows():
+            students = [by_id[sid] for sid in stop_row['student_ids']]
+            coords = (float(stop_row['latitude']), float(stop_row['longitude']))
+
+            # Splits stops bigger than a bus, like split_large_stops
+            for start in range(0, len(students), bus_capacity):
+                chunk = students[start:start + bus_capacity]
+                stop = {'latitude': coords[0], 'longitude': coords[1], 'address': None, 'students': chunk}
+                best = _cheapest_insertion(routes, coords, len(chunk), bus_capacity, school_coords)
+                if best is None:
+                    bus_number = max([route['bus_number'] for route in routes], default=0) + 1
+                    routes.append({'bus_number': bus_number, 'stops': [stop], 'total_distance_km': 0, 'map_path': None})
+                    distance_delta[bus_number] = 2 * _road_km(school_coords, coords)
+                else:
+                    cost, r, pos = best
+                    routes[r]['stops'].insert(pos, stop)
+                    distance_delta[routes[r]['bus_number']] = distance_delta.get(routes[r]['bus_number'], 0) + cost
+                    bus_number = routes[r]['bus_number']
+                touched.add(bus_number)
+                new_stops += 1
+
+    # Refreshes totals & sequence numbers, drops empty buses, & clears maps that no longer match their route
+    updated = []
+    for route in routes:
+        if not route['stops']:
+            continue
+        for seq, stop in enumerate(route['stops']):
+            stop['sequence_number'] = seq + 1
+        route['total_students'] = _route_load(route)
+        if route['bus_number'] in touched:
+            route['total_distance_km'] = max(0.0, float(route.get('total_distance_km') or 0) + distance_delta.get(route['bus_number'], 0))
+            route['estimated_duration_hr'] = round(route['total_distance_km'] / AVERAGE_SPEED_KMH, 2)
+            route['map_path'] = None
+        updated.append(route)
+
+    summary = {
+        "removed": removed_riders,
+        "reassigned_to_existing_stops": reassigned,
+        "new_stops": new_stops,
+        "new_walkers": [s['student_id'] for s in walkers],
+        "routes_changed": sorted(touched & {route['bus_number'] for route in updated}),
+        "routes_removed": len(routes) - len(updated)
+    }
+    return updated, summary
+
+# Updates the overview metrics of a run that the roster change affects
+def refresh_overview(overview: List[Dict], routes: List[Dict], total_walkers: int) -> List[Dict]:
+    riders = sum(route['total_students'] for route in routes)
+    stops = sum(len(route['stops']) for route in routes)
+    total_distance = sum(float(route['total_distance_km'] or 0) for route in routes)
+    values = {
+        "Total Students": riders,
+        "Total Buses": len(routes),
+        "Buses Actually Used": len(routes),
+        "Total Stops": stops,
+        "Bus Riders": riders,
+        "Walkers": total_walkers,
+        "Average Students per Stop": round(riders / stops, 2) if stops else 0,
+        "Total Route Distance (km)": round(total_distance, 2),
+        "Average Route Distance (km)": round(total_distance / len(routes), 2) if routes else 0
+    }
+
+    refreshed = []
+    for metric in overview or []:
+        metric = dict(metric)
+        if metric.get("Metric") in values:
+            metric["Value"] = values[metric["Metric"]]
+        refreshed.append(metric)
+    return refreshed
@@ -0,0 +1,106 @@
+'''
+    - Times each stage of the optimization pipeline: wall time, CPU time (including finished worker processes), & peak memory
+    - Peak memory is the resident set high water mark, so native OR-Tools/scipy memory counts
+    - The high water mark is reset between stages only when the pipeline owns its process (job worker)
+    - Anywhere else (e.g. the API threadpool) a reset would skew concurrent requests, so the peak is process wide (rss_per_stage False)
+    - PIPELINE_MEMORY_TRACKING=tracemalloc also records Python/numpy allocation peaks (slower, tracing adds overhead), "off" skips memory
+    - Forwards stage changes to an optional progress callback (used by the job queue's status endpoint)
+'''
+
+import os
+import time
+import resource
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+
+PIPELINE_MEMORY_TRACKING = os.getenv("PIPELINE_MEMORY_TRACKING", "rss")
+
+
+# CPU seconds used by this process & any child processes it has already waited on (pool workers)
+def _cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+# Resets the kernel's peak resident size counter (VmHWM) --> False where unsupported (non Linux)
+def _reset_peak_rss() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# Peak resident size in MB since the last reset (process lifetime max when never reset)
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Records stages one after another: start("x") closes the running stage & opens x, finish() closes the last one
+class StageProfiler:
+    def __init__(self, progress: Optional[Callable[[str], None]] = None, memory: str = PIPELINE_MEMORY_TRACKING, reset_peak_rss: bool = False):
+        self.progress = progress
+        self.memory = memory
+        self.reset_peak_rss = reset_peak_rss
+        self.stages: List[Dict] = []
+        self._current = None
+        self._started_tracing = False
+
+        if memory == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def start(self, stage: str):
+        self._close()
+        if self.progress:
+            self.progress(stage)
+
+        per_stage_rss = False
+        if self.memory != "off" and self.reset_peak_rss:
+            per_stage_rss = _reset_peak_rss()
+        if self.memory == "tracemalloc":
+            tracemalloc.reset_peak()
+        self._current = (stage, time.perf_counter(), _cpu_seconds(), per_stage_rss)
+
+    def _close(self):
+        if self._current is None:
+            return
+        stage, wall_start, cpu_start, per_stage_rss = self._current
+        self._current = None
+
+        record = {
+            "stage": stage,
+            "wall_s": round(time.perf_counter() - wall_start, 3),
+            "cpu_s": round(_cpu_seconds() - cpu_start, 3),
+            "peak_rss_mb": None,
+            "rss_per_stage": per_stage_rss,
+            "peak_traced_mb": None
+        }
+        if self.memory != "off":
+            record["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        if self.memory == "tracemalloc":
+            record["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        self.stages.append(record)
+
+    # Closes the last stage, stops tracing if this profiler started it, & returns the stage records
+    def finish(self, completed: bool = True) -> List[Dict]:
+        self._close()
+        if self.progress and completed:
+            self.progress("done")
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        for s in self.stages:
+            peak = f"{s['peak_rss_mb']:>8.1f} MB" if s['peak_rss_mb'] is not None else "       n/a"
+            print(f"  {s['stage']:<20} wall {s['wall_s']:>8.2f}s   cpu {s['cpu_s']:>8.2f}s   peak {peak}")
+        print(f"Pipeline total: {sum(s['wall_s'] for s in self.stages):.2f}s")
+        return self.stages
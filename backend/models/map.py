@@ -1,47 +1,101 @@
 '''
-    - Snaps bus stops to nearest road network nodes using OSMnx & stores snapped coordinates
-    - Precomputes shortest paths between all stops to speed up route plotting
+    - Snaps bus stops to nearest road network nodes in one batched query against a cached BallTree & stores snapped coordinates
+    - Rebuilds shortest paths only for route legs, from leg origins in batches bounded by the routing sweep's distances
     - Generates interactive Folium maps showing multiple bus routes and stop markers
     - Creates individual HTML maps for each bus route and saves them to disk
 '''
 
+import numpy as np
 import pandas as pd
-import osmnx as ox
 import networkx as nx
 import folium
 from typing import List, Tuple
 import os, folium
 from datetime import datetime
-
-# Snaps stops to nearest road netwrok nodes & stores snapped coordinates
+from sklearn.neighbors import BallTree
+from pyproj import CRS
+from models.routing import shortest_leg_paths, node_coordinates
+from models.graph_store import stored_arrays, as_networkx
+
+# Builds a haversine BallTree over graph node coordinates once & caches it on the graph (alongside the routing CSR matrix)
+def graph_node_index(G: nx.Graph) -> Tuple[BallTree, np.ndarray, np.ndarray, np.ndarray]:
+    cached = G.graph.get("_node_index")
+    if cached is not None:
+        return cached
+
+    if G.graph.get("store_path"):
+        arrays = stored_arrays(G)
+        node_ids = np.asarray(arrays["node_ids"])
+        node_x = np.asarray(arrays["node_x"])
+        node_y = np.asarray(arrays["node_y"])
+    else:
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        node_x = np.array([G.nodes[n]['x'] for n in node_ids.tolist()])
+        node_y = np.array([G.nodes[n]['y'] for n in node_ids.tolist()])
+
+    tree = BallTree(np.radians(np.column_stack([node_y, node_x])), metric='haversine')
+    G.graph["_node_index"] = (tree, node_ids, node_x, node_y)
+    return G.graph["_node_index"]
+
+# Same check as ox.projection.is_projected without importing osmnx (which loads matplotlib.pyplot through osmnx.plot)
+def _is_projected(crs) -> bool:
+    return crs is not None and CRS.from_user_input(crs).is_projected
+
+# Finds nearest graph node for every lat/lon pair in one query
+def nearest_graph_nodes(G: nx.Graph, lats, lons) -> np.ndarray:
+    if _is_projected(G.graph.get("crs")):
+        import osmnx as ox
+        return np.asarray(ox.distance.nearest_nodes(as_networkx(G), np.asarray(lons), np.asarray(lats)))
+
+    tree, node_ids, _, _ = graph_node_index(G)
+    _, idx = tree.query(np.radians(np.column_stack([lats, lons])), k=1)
+    return node_ids[idx[:, 0]]
+
+# Snaps stops to nearest road netwrok nodes & stores snapped coordinates (school keeps its own coordinates)
 def snap_stops_to_graph(stop_df: pd.DataFrame, G: nx.Graph) -> pd.DataFrame:
-    def get_snapped_coords(row):
-        if row['stop_id'] == 'school':
-            node = ox.distance.nearest_nodes(G, row['longitude'], row['latitude'])
-            return pd.Series({
-                'graph_node': node,
-                'snapped_lat': row['latitude'],
-                'snapped_lon': row['longitude']
-            })
-        else:
-            node = ox.distance.nearest_nodes(G, row['longitude'], row['latitude'])
-            return pd.Series({
-                'graph_node': node,
-                'snapped_lat': G.nodes[node]['y'],
-                'snapped_lon': G.nodes[node]['x']
-            })
-    stop_df[['graph_node','snapped_lat','snapped_lon']] = stop_df.apply(get_snapped_coords, axis=1)
+    lats = stop_df['latitude'].to_numpy(dtype=float)
+    lons = stop_df['longitude'].to_numpy(dtype=float)
+
+    if _is_projected(G.graph.get("crs")):
+        nodes = nearest_graph_nodes(G, lats, lons)
+        node_lat, node_lon = node_coordinates(G, nodes.tolist())
+    else:
+        tree, node_ids, node_x, node_y = graph_node_index(G)
+        _, idx = tree.query(np.radians(np.column_stack([lats, lons])), k=1)
+        idx = idx[:, 0]
+        nodes, node_lat, node_lon = node_ids[idx], node_y[idx], node_x[idx]
+
+    is_school = (stop_df['stop_id'] == 'school').to_numpy()
+    stop_df['graph_node'] = nodes
+    stop_df['snapped_lat'] = np.where(is_school, lats, node_lat)
+    stop_df['snapped_lon'] = np.where(is_school, lons, node_lon)
     return stop_df
 
-# Precomputes shortest paths between all stop nodes in graph
-def precompute_paths(G: nx.Graph, stop_nodes: List[int]):
+# Builds paths only for the legs that appear in routes (after the solve), bounding each search by the sweep's leg distances
+# Falls back to a networkx shortest path per leg when the sweep used the networkx engine
+def route_leg_paths(G: nx.Graph, sweep: dict, stop_df: pd.DataFrame, routes: List[List[int]]) -> dict:
+    graph_nodes = stop_df['graph_node'].tolist()
+    legs = list(dict.fromkeys(
+        (graph_nodes[route[i]], graph_nodes[route[i+1]])
+        for route in routes for i in range(len(route) - 1)
+        if graph_nodes[route[i]] != graph_nodes[route[i+1]]
+    ))
+
+    if sweep.get("engine") == "csgraph":
+        row_of = {node: i for i, node in enumerate(sweep["nodes"])}
+        leg_distances = {
+            (orig, dest): sweep["dist"][row_of[orig], row_of[dest]]
+            for orig, dest in legs if orig in row_of and dest in row_of
+        }
+        return shortest_leg_paths(G, legs, leg_distances)
+
+    G = as_networkx(G)
     path_dict = {}
-    for orig in stop_nodes:
-        # Runs Dijkstra from orig to all other nodes once
-        lengths, paths = nx.single_source_dijkstra(G, source=orig, weight="length")
-        for dest in stop_nodes:
-            if orig != dest and dest in paths:
-                path_dict[(orig, dest)] = paths[dest]
+    for orig, dest in legs:
+        try:
+            path_dict[(orig, dest)] = nx.shortest_path(G, orig, dest, weight="length")
+        except nx.NetworkXNoPath:
+            pass
     return path_dict
 
 # Generates folium map with multiple bus routes & stop markers
@@ -62,7 +116,7 @@ def create_route_map(G: nx.Graph, stop_df: pd.DataFrame, all_routes: List[List[i
             # Lookups path instead of recalculating
             path = path_dict.get((origin_node, dest_node))
             if path:
-                coords = [(G.nodes[n]['y'], G.nodes[n]['x']) for n in path]
+                coords = list(zip(*(c.tolist() for c in node_coordinates(G, path))))
                 folium.PolyLine(coords, color=route_color, weight=4, opacity=0.8).add_to(m)
 
 
@@ -92,7 +146,7 @@ def create_individual_route_maps(G, stop_df, routes, school_coords, path_dict, o
             dest_node   = stop_df.iloc[route[j+1]]['graph_node']
             path = path_dict.get((origin_node, dest_node))
             if path:
-                coords = [(G.nodes[n]['y'], G.nodes[n]['x']) for n in path]
+                coords = list(zip(*(c.tolist() for c in node_coordinates(G, path))))
                 folium.PolyLine(coords, color='blue', weight=4, opacity=0.8).add_to(m)
 
         # Adds stops
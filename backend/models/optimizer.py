@@ -2,18 +2,19 @@
     - Implements full bus route optimization pipeline for a school
     - Determines which students need buses vs. who can walk safely
     - Clusters bus riders into stops using machine learning (KMeans) & enforces max walking distance
-    - Snaps stops to road network, computes distance matrix, & solves VRP with fleet constraints
+    - Loads road network from the local graph store, snaps stops to it, computes distance matrix, & solves VRP with fleet constraints
     - Generates route maps (overall & individual) using Folium
     - Computes metrics, overview, & detailed route/student information for reporting
 '''
 
 import os
-import osmnx as ox
 from models.loader import load_student_data
 from models.clustering import find_optimal_clusters, create_stop_df, enforce_max_distance
-from models.routing import build_distance_matrix, solve_vrp_with_fleet_limit, split_large_stops
-from models.map import create_route_map, snap_stops_to_graph, precompute_paths, create_individual_route_maps
+from models.routing import shortest_path_sweep, build_distance_matrix, solve_vrp_with_fleet_limit, split_large_stops, warm_start_routes
+from models.graph_store import load_or_download_graph
+from models.map import create_route_map, snap_stops_to_graph, route_leg_paths, create_individual_route_maps
 from models.info import calculate_admin_metrics, generate_overview_metrics, generate_route_details
+from models.instrumentation import StageProfiler
 from sklearn.metrics.pairwise import haversine_distances
 import numpy as np
 import pandas as pd
@@ -21,6 +22,8 @@ from datetime import datetime
 import os
 
 
+# Runs the pipeline & adds wall time, CPU time & peak memory of each stage to the results ("stage_timings")
+# dedicated_process=True when the pipeline owns its process (job worker), so peak memory can be measured per stage
 def full_optimization_pipeline(
     df: pd.DataFrame,
     school_coords=(40.496296, -74.654846),
@@ -29,12 +32,62 @@ def full_optimization_pipeline(
     safe_walk_miles=1.5,
     map_output_path="assets/optimized_route_map.html",
     generate_map=True,
-    precompute=True
+    precompute=True,
+    cluster_search="full",
+    cluster_minibatch=False,
+    vrp_mode="sequential",
+    vrp_time_budget_s=None,
+    previous_routes=None,
+    progress=None,
+    dedicated_process=False
+):
+    profiler = StageProfiler(progress, reset_peak_rss=dedicated_process)
+    try:
+        results = _pipeline_stages(
+            df,
+            profiler,
+            school_coords=school_coords,
+            bus_capacity=bus_capacity,
+            num_bus=num_bus,
+            safe_walk_miles=safe_walk_miles,
+            map_output_path=map_output_path,
+            generate_map=generate_map,
+            precompute=precompute,
+            cluster_search=cluster_search,
+            cluster_minibatch=cluster_minibatch,
+            vrp_mode=vrp_mode,
+            vrp_time_budget_s=vrp_time_budget_s,
+            previous_routes=previous_routes
+        )
+    except Exception:
+        profiler.finish(completed=False)
+        raise
+    results["stage_timings"] = profiler.finish()
+    return results
+
+
+def _pipeline_stages(
+    df: pd.DataFrame,
+    profiler: StageProfiler,
+    *,
+    school_coords,
+    bus_capacity,
+    num_bus,
+    safe_walk_miles,
+    map_output_path,
+    generate_map,
+    precompute,
+    cluster_search,
+    cluster_minibatch,
+    vrp_mode,
+    vrp_time_budget_s,
+    previous_routes
 ):
 
     SAFE_WALK_KM = (safe_walk_miles / 2.7) * 1.60934
 
     # DISTANCE TO SCHOOL
+    profiler.start("distance_to_school")
     student_coords_rad = np.radians(df[['Latitude', 'Longitude']].to_numpy())
     school_coords_rad = np.radians(np.array([school_coords]))
     distances_rad = haversine_distances(student_coords_rad, school_coords_rad)
@@ -47,41 +100,53 @@ def full_optimization_pipeline(
     df_walkers = df[~df['needs_bus']].copy()
     
     # CLUSTERING
+    profiler.start("clustering")
     coords = df_bus[['Latitude', 'Longitude']].to_numpy()
-    optimal_k, kmeans_model, inertias = find_optimal_clusters(coords)
-    df_bus['assigned_stop_id'] = kmeans_model.predict(coords)
-    centroids_rad = np.radians(kmeans_model.cluster_centers_)
-    student_coords_rad = np.radians(coords)
-    distances_rad = haversine_distances(student_coords_rad, centroids_rad)
-    df_bus['distance_to_stop_km'] = distances_rad[np.arange(len(df_bus)), df_bus['assigned_stop_id']]
-    df_bus = enforce_max_distance(df_bus, 1)
+    k_range = range(1, 31)
+    optimal_k, kmeans_model, inertias = find_optimal_clusters(coords, k_range=k_range, search=cluster_search, minibatch=cluster_minibatch)
+    elbow = {
+        "k_values": list(k_range),
+        "inertias": [float(i) if i is not None else None for i in inertias],
+        "optimal_k": int(optimal_k)
+    }
+    df_bus['assigned_stop_id'] = kmeans_model.labels_
+
+    profiler.start("max_walk_distance")
+    df_bus, max_walk_status = enforce_max_distance(df_bus, 1)
     
 
     # CREATE STOPS
+    profiler.start("stops")
     stop_df = create_stop_df(df_bus, kmeans_model=None, school_coords=school_coords)
     
 
     # ROAD NETWORK
-    
-    G = ox.graph_from_point(
+    profiler.start("graph_load")
+    G = load_or_download_graph(
         (df_bus['Latitude'].mean(), df_bus['Longitude'].mean()),
         dist=10000,
         network_type='drive'
     )
+    profiler.start("snapping")
     stop_df = snap_stops_to_graph(stop_df, G)
     
 
     # DISTANCE MATRIX
+    profiler.start("distance_matrix")
+    # One shortest path sweep gives the distances for the VRP & bounds the route leg searches after the solve
     stop_nodes = stop_df['graph_node'].tolist()
-    dist_matrix = build_distance_matrix(G, stop_nodes)
+    sweep = shortest_path_sweep(G, stop_nodes)
+    node_distances = (sweep["nodes"], sweep["dist"])
 
     # BUS CAPACITY
+    # Split stops share their parent's graph node, so the matrix is expanded from the one computed above
     stop_df = split_large_stops(stop_df, bus_capacity)
     stop_nodes = stop_df['graph_node'].tolist()
-    dist_matrix = build_distance_matrix(G, stop_nodes)
+    dist_matrix = build_distance_matrix(G, stop_nodes, base=node_distances)
     dist_matrix_km = dist_matrix / 1000
     
     # VRP WITH FLEET CONSTRAINTS
+    profiler.start("vrp")
     vehicle_capacities = [bus_capacity] * num_bus
     school_indices = stop_df[stop_df['stop_id'] == 'school'].index
     if len(school_indices) == 0:
@@ -89,6 +154,10 @@ def full_optimization_pipeline(
     depot_index = stop_df.index.get_loc(school_indices[0])
     demands = stop_df['num_students'].tolist()
 
+    # Seeds the solver with a previous run's routes (lists of stop coordinates) matched to the new stops
+    initial_routes = None
+    if previous_routes:
+        initial_routes = warm_start_routes(previous_routes, stop_df, dist_matrix_km, demands, bus_capacity, depot_index)
 
     routes, vrp_metrics = solve_vrp_with_fleet_limit(
         dist_matrix_km, 
@@ -96,7 +165,10 @@ def full_optimization_pipeline(
         vehicle_capacities, 
         depot_index=depot_index,
         max_buses=num_bus,
-        min_buses=max(1, num_bus // 2)
+        min_buses=max(1, num_bus // 2),
+        mode=vrp_mode,
+        time_budget_s=vrp_time_budget_s,
+        initial_routes=initial_routes
     )
     
     if not routes:
@@ -111,14 +183,15 @@ def full_optimization_pipeline(
     actual_num_buses = len(routes)
     
     # PRECOMPUTE PATHS & MAP 
+    profiler.start("path_precompute")
     path_dict = {}
     individual_map_paths = []
     
     if precompute:
-       
-        path_dict = precompute_paths(G, stop_nodes)
+        path_dict = route_leg_paths(G, sweep, stop_df, routes)
 
 
+    profiler.start("map_rendering")
     if generate_map:
         m = create_route_map(G, stop_df, routes, school_coords, path_dict)
     
@@ -135,6 +208,7 @@ def full_optimization_pipeline(
         map_output_path = None
 
     # METRICS 
+    profiler.start("metrics")
     metrics = calculate_admin_metrics(stop_df, routes, vehicle_capacities)
     overview_df = generate_overview_metrics(stop_df, routes, vehicle_capacities, dist_matrix_km)
     
@@ -149,6 +223,7 @@ def full_optimization_pipeline(
         {"Metric": "Average Bus Load", "Value": f"{vrp_metrics.get('avg_load', 0):.1f} students"}
     ])
     
+    profiler.start("route_details")
     route_details = generate_route_details(
         stop_df, 
         routes, 
@@ -168,6 +243,8 @@ def full_optimization_pipeline(
         "map_path": map_output_path,
         "individual_map_paths": individual_map_paths,
         "optimization_metrics": vrp_metrics,
+        "elbow": elbow,
+        "max_walk_status": max_walk_status,
         "df_with_analysis": df, 
         "df_walkers": df_walkers,  
         "df_bus_riders": df_bus 
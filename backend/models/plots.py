@@ -0,0 +1,33 @@
+'''
+    - Renders optional chart artifacts (elbow method) outside of the optimization request
+    - Uses the headless Agg backend & imports matplotlib lazily so the pipeline never pays for it
+'''
+
+import os
+from typing import List, Optional
+
+
+# Draws the elbow method chart from a stored inertia series & saves it as a PNG
+def render_elbow_plot(k_values: List[int], inertias: List[Optional[float]], optimal_k: int, output_path: str, dpi: int = 150) -> str:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    # Skips k values that were never fitted (coarse-to-fine search)
+    points = [(k, inertia) for k, inertia in zip(k_values, inertias) if inertia is not None]
+
+    fig, ax = plt.subplots()
+    ax.plot([k for k, _ in points], [inertia for _, inertia in points], marker='o')
+    ax.axvline(optimal_k, color='red', linestyle='--', label=f'Elbow at k={optimal_k}')
+    ax.set_xticks(k_values)
+    ax.set_xlabel('Number of Clusters (k)')
+    ax.set_ylabel('Inertia')
+    ax.set_title('Elbow Method for Optimal k')
+    ax.legend()
+    ax.grid(True)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    fig.savefig(output_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+    return output_path
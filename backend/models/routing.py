@@ -1,35 +1,233 @@
 '''
-    - Solves the Vehicle Routing Problem (VRP) with flexible fleet size for school buses
+    - Solves the Vehicle Routing Problem (VRP) with flexible fleet size for school buses (fleet size loop, process pool, or one fixed cost model)
     - Splits large stops if student demand exceeds bus capacity
-    - Computes shortest driving distance between stops on a road network
+    - Computes shortest driving distance between stops on a road network (once per unique graph node, SciPy Dijkstra on a CSR matrix)
     - Returns optimized bus routes, metrics, & adjusted stop data
 '''
 
 import numpy as np
 import networkx as nx
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from sklearn.metrics.pairwise import haversine_distances
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import pandas as pd
 import math
+import os
+import time
+import multiprocessing
+from models.graph_store import stored_arrays, as_networkx
 
+EARTH_RADIUS_M = 6371000
+DETOUR_FACTOR = 2.5
+
+
+# Registers distance & demand with OR-Tools as plain node indexed data, so the search evaluates them in C++ without calling back into Python
+# Older OR-Tools builds without matrix registration get callbacks over a precomputed index to node array instead
+def _register_transits(routing, manager, dist_matrix: np.ndarray, demands: List[int]) -> Tuple[int, int]:
+    # Truncates like int() did on each callback call
+    int_matrix = np.asarray(dist_matrix).astype(np.int64)
+    int_demands = [int(d) for d in demands]
+
+    if hasattr(routing, "RegisterTransitMatrix") and hasattr(routing, "RegisterUnaryTransitVector"):
+        return routing.RegisterTransitMatrix(int_matrix.tolist()), routing.RegisterUnaryTransitVector(int_demands)
+
+    index_to_node = np.array([manager.IndexToNode(i) for i in range(routing.Size() + routing.vehicles())])
+    matrix_rows = int_matrix.tolist()
+
+    def distance_callback(from_index, to_index):
+        return matrix_rows[index_to_node[from_index]][index_to_node[to_index]]
+
+    def demand_callback(from_index):
+        return int_demands[index_to_node[from_index]]
+
+    return routing.RegisterTransitCallback(distance_callback), routing.RegisterUnaryTransitCallback(demand_callback)
+
+# Builds & solves one routing model for a fixed number of buses --> module level so it can run in a worker process
+# vehicle_fixed_cost > 0 charges every bus that leaves the depot, so the solver keeps unneeded buses home
+# initial_routes (stop indices without the depot) seed guided local search instead of building a first solution from scratch
+# Returns (num_vehicles, routes, total_distance, buses_used), with routes None when no solution was found
+def _solve_fleet_size(
+    dist_matrix: np.ndarray,
+    demands: List[int],
+    capacity: int,
+    depot_index: int,
+    num_vehicles: int,
+    time_limit_s: float = 30,
+    vehicle_fixed_cost: int = 0,
+    initial_routes: List[List[int]] = None
+):
+    num_stops = len(dist_matrix)
+
+    # Creates routing model
+    manager = pywrapcp.RoutingIndexManager(num_stops, num_vehicles, depot_index)
+    routing = pywrapcp.RoutingModel(manager)
+
+    transit_callback_index, demand_callback_index = _register_transits(routing, manager, dist_matrix, demands)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    if vehicle_fixed_cost:
+        routing.SetFixedCostOfAllVehicles(int(vehicle_fixed_cost))
+
+    # Uses same capacity for all buses
+    capacities = [capacity] * num_vehicles
+
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index,
+        0,
+        capacities,
+        True,
+        'Capacity'
+    )
+
+
+    search_params = pywrapcp.DefaultRoutingSearchParameters()
+    search_params.time_limit.FromMilliseconds(max(1000, int(time_limit_s * 1000)))  # Short limit per attempt
+    search_params.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+    )
+    search_params.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    )
+
+    # Solves (from the warm start when it fits this fleet & passes the model's constraints)
+    initial_assignment = None
+    if initial_routes and len(initial_routes) <= num_vehicles:
+        routing.CloseModelWithParameters(search_params)
+        padded_routes = [list(r) for r in initial_routes] + [[] for _ in range(num_vehicles - len(initial_routes))]
+        initial_assignment = routing.ReadAssignmentFromRoutes(padded_routes, True)
+        if initial_assignment is None:
+            print(f"Warm start rejected for {num_vehicles} buses, solving from scratch")
+
+    if initial_assignment is not None:
+        solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_params)
+    else:
+        solution = routing.SolveWithParameters(search_params)
+
+    if not solution:
+        return num_vehicles, None, None, 0
+
+    routes = []
+    total_distance = 0
+    buses_used = 0
+
+    for vehicle_id in range(num_vehicles):
+        index = routing.Start(vehicle_id)
+        route = []
+        route_distance = 0
+
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            previous_index = index
+            index = solution.Value(routing.NextVar(index))
+            route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
+
+        route.append(manager.IndexToNode(index))
+
+        # Arc cost out of the depot includes the bus's fixed cost --> only distance is reported
+        if len(route) > 2:
+            route_distance -= vehicle_fixed_cost
+
+        # Only counts routes that serve students (not just depot)
+        route_load = sum(demands[i] for i in route if i != depot_index)
+        if route_load > 0:
+            routes.append(route)
+            total_distance += route_distance
+            buses_used += 1
+
+    return num_vehicles, routes, total_distance, buses_used
+
+# Worker entry point for the process pool (Pool.imap_unordered passes one tuple)
+def _solve_fleet_size_star(args):
+    return _solve_fleet_size(*args)
+
+# Solves candidate fleet sizes concurrently & stops the pool as soon as a near optimal fleet size comes back or the budget runs out
+# Yields results as they finish, then terminates workers still solving
+def _solve_fleet_sizes_parallel(dist_matrix, demands, capacity, depot_index, candidates, attempt_time_limit_s, deadline, max_workers, near_optimal, initial_routes=None):
+    # Keeps each attempt inside the budget (minus a little slack for model building) so at least the first wave can finish
+    if deadline is not None:
+        attempt_time_limit_s = min(attempt_time_limit_s, max(1, deadline - time.monotonic() - 0.5))
+    tasks = [(dist_matrix, demands, capacity, depot_index, num_vehicles, attempt_time_limit_s, 0, initial_routes) for num_vehicles in candidates]
+    pool = multiprocessing.Pool(processes=min(max_workers or os.cpu_count() or 1, len(tasks)))
+    try:
+        results = pool.imap_unordered(_solve_fleet_size_star, tasks)
+        for _ in tasks:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                print("VRP time budget exhausted, cancelling remaining attempts")
+                return
+            try:
+                result = results.next(timeout=remaining)
+            except multiprocessing.TimeoutError:
+                print("VRP time budget exhausted, cancelling remaining attempts")
+                return
+            yield result
+            if result[1] is not None and near_optimal(result[3]):
+                print(f"Near-optimal solution found, cancelling remaining attempts")
+                return
+    finally:
+        pool.terminate()
+        pool.join()
+
+# Summarizes the chosen routes into the metrics dict returned with them
+def _vrp_metrics(best_routes, best_num_buses, demands, vehicle_capacities, depot_index, max_buses, theoretical_min_buses, total_demand):
+    bus_loads = [sum(demands[i] for i in route if i != depot_index) for route in best_routes]
+    overloaded = [i for i, load in enumerate(bus_loads) if load > vehicle_capacities[0]]
+    underutilized = [i for i, load in enumerate(bus_loads) if load < vehicle_capacities[0] * 0.5]
+
+    metrics = {
+        "buses_requested": max_buses,
+        "buses_used": best_num_buses,
+        "theoretical_minimum": theoretical_min_buses,
+        "efficiency_gain": f"{((max_buses - best_num_buses) / max_buses * 100):.1f}%",
+        "total_students": total_demand,
+        "bus_loads": bus_loads,
+        "avg_load": sum(bus_loads) / len(bus_loads),
+        "overloaded_buses": overloaded,
+        "underutilized_buses": underutilized,
+        "status": "optimal" if best_num_buses == theoretical_min_buses else "good"
+    }
+
+
+    if overloaded:
+        print(f"Overloaded buses: {len(overloaded)}")
+    if underutilized:
+        print(f" Underutilized buses: {len(underutilized)}")
+    print(f"{'='*60}\n")
+
+    return metrics
+
+# Default fixed cost per bus --> more than any single tour through every stop, so dropping a bus always beats saving distance
+def _default_vehicle_fixed_cost(dist_matrix: np.ndarray) -> int:
+    return int(np.asarray(dist_matrix).max(axis=1).sum()) + 1
 
 # Solves school bus VRP with flexible fleet size, adjusting number of buses between min and max to serve all students while respecting capacities
+# mode="sequential" tries fleet sizes one after another, mode="parallel" solves several at once in a process pool
+# mode="fixed_cost" builds a single model with max_buses vehicles & a fixed cost per used bus (time_budget_s, if given, is its time limit)
+# time_budget_s caps the whole search (each attempt also keeps its own attempt_time_limit_s)
+# initial_routes (see warm_start_routes) seed every attempt that has enough buses for them
 def solve_vrp_with_fleet_limit(
     dist_matrix: np.ndarray, 
     demands: List[int], 
     vehicle_capacities: List[int], 
     depot_index: int,
     max_buses: int,
-    min_buses: int = None
+    min_buses: int = None,
+    mode: str = "sequential",
+    time_budget_s: float = None,
+    attempt_time_limit_s: float = 30,
+    max_workers: int = None,
+    vehicle_fixed_cost: int = None,
+    initial_routes: List[List[int]] = None
 ) -> Tuple[List[List[int]], dict]:
     
     if min_buses is None:
         min_buses = max(1, max_buses // 2)
     
-    num_stops = len(dist_matrix)
     total_demand = sum(demands)
     theoretical_min_buses = math.ceil(total_demand / vehicle_capacities[0])
+    deadline = time.monotonic() + time_budget_s if time_budget_s is not None else None
     
     
     # Checks if problem is solvable
@@ -39,121 +237,64 @@ def solve_vrp_with_fleet_limit(
         print(f"Proceeding with {max_buses} buses (may result in overcrowding)")
     
     # Tries to find optimal solution within bounds
-    best_solution = None
     best_routes = []
     best_num_buses = max_buses
-    
+    best_distance = None
+
     # Starts with theoretical minimum --> work up to maximum
-    for num_vehicles in range(max(theoretical_min_buses, min_buses), max_buses + 1):
-        print(f"Attempting with {num_vehicles} buses...")
-        
-        # Creates routing model
-        manager = pywrapcp.RoutingIndexManager(num_stops, num_vehicles, depot_index)
-        routing = pywrapcp.RoutingModel(manager)
-        
-        def distance_callback(from_index, to_index):
-            return int(dist_matrix[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)])
-        
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-        
-      
-        def demand_callback(from_index):
-            return demands[manager.IndexToNode(from_index)]
-        
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        
-        # Uses same capacity for all buses
-        capacities = [vehicle_capacities[0]] * num_vehicles
-        
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index,
-            0, 
-            capacities,
-            True,
-            'Capacity'
-        )
-        
+    candidates = list(range(max(theoretical_min_buses, min_buses), max_buses + 1))
+    near_optimal = lambda buses_used: buses_used <= theoretical_min_buses + 2
 
-        search_params = pywrapcp.DefaultRoutingSearchParameters()
-        search_params.time_limit.seconds = 30  # Short limit per attempt
-        search_params.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
-        )
-        search_params.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    if mode == "parallel":
+        print(f"Attempting {len(candidates)} fleet sizes in parallel...")
+        attempts = _solve_fleet_sizes_parallel(
+            dist_matrix, demands, vehicle_capacities[0], depot_index, candidates,
+            attempt_time_limit_s, deadline, max_workers, near_optimal, initial_routes
         )
-        
-        # Solves
-        solution = routing.SolveWithParameters(search_params)
-        
-        if solution:
-            routes = []
-            total_distance = 0
-            buses_used = 0
-            
-            for vehicle_id in range(num_vehicles):
-                index = routing.Start(vehicle_id)
-                route = []
-                route_distance = 0
-                
-                while not routing.IsEnd(index):
-                    route.append(manager.IndexToNode(index))
-                    previous_index = index
-                    index = solution.Value(routing.NextVar(index))
-                    route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
-                
-                route.append(manager.IndexToNode(index))
-                
-                # Only counts routes that serve students (not just depot)
-                route_load = sum(demands[i] for i in route if i != depot_index)
-                if route_load > 0:
-                    routes.append(route)
-                    total_distance += route_distance
-                    buses_used += 1
-            
-            print(f"Found solution with {buses_used} active buses")
-            print(f"     Total distance: {total_distance/1000:.1f} km")
-            
-            # Keeps solution with fewest buses
-            if buses_used < best_num_buses:
-                best_solution = solution
-                best_routes = routes
-                best_num_buses = buses_used
-                
+    elif mode == "fixed_cost":
+        if vehicle_fixed_cost is None:
+            vehicle_fixed_cost = _default_vehicle_fixed_cost(dist_matrix)
+        time_limit_s = time_budget_s if time_budget_s is not None else attempt_time_limit_s
+        num_vehicles = max(max_buses, min_buses)
+        print(f"Solving once with {num_vehicles} available buses (fixed cost {vehicle_fixed_cost} per bus)...")
+        attempts = [_solve_fleet_size(dist_matrix, demands, vehicle_capacities[0], depot_index, num_vehicles, time_limit_s, vehicle_fixed_cost, initial_routes)]
+    elif mode == "sequential":
+        def sequential_attempts():
+            for num_vehicles in candidates:
+                time_limit_s = attempt_time_limit_s
+                if deadline is not None:
+                    time_limit_s = min(time_limit_s, deadline - time.monotonic())
+                    if time_limit_s < 1:
+                        print("VRP time budget exhausted, stopping search")
+                        return
+                print(f"Attempting with {num_vehicles} buses...")
+                result = _solve_fleet_size(dist_matrix, demands, vehicle_capacities[0], depot_index, num_vehicles, time_limit_s, 0, initial_routes)
+                yield result
                 # If we found a good solution, we can stop early
-                if buses_used <= theoretical_min_buses + 2: 
+                if result[1] is not None and near_optimal(result[3]):
                     print(f"Near-optimal solution found, stopping search")
-                    break
-        else:
+                    return
+        attempts = sequential_attempts()
+    else:
+        raise ValueError(f"Unknown VRP mode: {mode}")
+
+    for num_vehicles, routes, total_distance, buses_used in attempts:
+        if routes is None:
             print(f" No solution found with {num_vehicles} buses")
+            continue
+
+        print(f"Found solution with {buses_used} active buses ({num_vehicles} available)")
+        print(f"     Total distance: {total_distance/1000:.1f} km")
+
+        # Keeps solution with fewest buses (shorter total distance breaks ties between parallel attempts)
+        if not best_routes or buses_used < best_num_buses or (buses_used == best_num_buses and total_distance < best_distance):
+            best_routes = routes
+            best_num_buses = buses_used
+            best_distance = total_distance
     
     # Prepares metrics
     if best_routes:
-        bus_loads = [sum(demands[i] for i in route if i != depot_index) for route in best_routes]
-        overloaded = [i for i, load in enumerate(bus_loads) if load > vehicle_capacities[0]]
-        underutilized = [i for i, load in enumerate(bus_loads) if load < vehicle_capacities[0] * 0.5]
-        
-        metrics = {
-            "buses_requested": max_buses,
-            "buses_used": best_num_buses,
-            "theoretical_minimum": theoretical_min_buses,
-            "efficiency_gain": f"{((max_buses - best_num_buses) / max_buses * 100):.1f}%",
-            "total_students": total_demand,
-            "bus_loads": bus_loads,
-            "avg_load": sum(bus_loads) / len(bus_loads),
-            "overloaded_buses": overloaded,
-            "underutilized_buses": underutilized,
-            "status": "optimal" if best_num_buses == theoretical_min_buses else "good"
-        }
-        
-    
-        if overloaded:
-            print(f"Overloaded buses: {len(overloaded)}")
-        if underutilized:
-            print(f" Underutilized buses: {len(underutilized)}")
-        print(f"{'='*60}\n")
-        
+        metrics = _vrp_metrics(best_routes, best_num_buses, demands, vehicle_capacities, depot_index, max_buses, theoretical_min_buses, total_demand)
         return best_routes, metrics
     else:
         print(f"\nOPTIMIZATION FAILED - No feasible solution found")
@@ -161,6 +302,75 @@ def solve_vrp_with_fleet_limit(
         return [], {}
 
 
+# Builds initial VRP routes from a previous run's routes (lists of (lat, lon) stops in order) for warm starting the solver
+# Each new stop joins the route of the nearest previous stop within max_match_km, ordered by that stop's sequence
+# Stops that don't match (or overflow a bus) are added by cheapest insertion, opening new routes when every bus is full
+def warm_start_routes(
+    previous_routes: List[List[Tuple[float, float]]],
+    stop_df: pd.DataFrame,
+    dist_matrix: np.ndarray,
+    demands: List[int],
+    capacity: int,
+    depot_index: int,
+    max_match_km: float = 0.5
+) -> List[List[int]]:
+    previous_stops = [(route_idx, seq, lat, lon) for route_idx, route in enumerate(previous_routes) for seq, (lat, lon) in enumerate(route)]
+    stop_indices = [i for i in range(len(stop_df)) if i != depot_index]
+    if not previous_stops or not stop_indices:
+        return []
+
+    # Matches every new stop to its nearest previous stop
+    previous_rad = np.radians([[lat, lon] for _, _, lat, lon in previous_stops])
+    new_rad = np.radians(stop_df.iloc[stop_indices][['latitude', 'longitude']].to_numpy(dtype=float))
+    distances = haversine_distances(new_rad, previous_rad) * EARTH_RADIUS_M / 1000
+    nearest = distances.argmin(axis=1)
+
+    matched = {}
+    leftovers = []
+    for stop_idx, prev_idx, dist_km in zip(stop_indices, nearest, distances[np.arange(len(stop_indices)), nearest]):
+        if dist_km > max_match_km:
+            leftovers.append(stop_idx)
+            continue
+        route_idx, seq, _, _ = previous_stops[prev_idx]
+        matched.setdefault(route_idx, []).append((seq, dist_km, stop_idx))
+
+    # Keeps previous order & trims routes back to bus capacity
+    routes, loads = [], []
+    for route_idx in sorted(matched):
+        route, load = [], 0
+        for _, _, stop_idx in sorted(matched[route_idx]):
+            if load + demands[stop_idx] > capacity:
+                leftovers.append(stop_idx)
+                continue
+            route.append(stop_idx)
+            load += demands[stop_idx]
+        if route:
+            routes.append(route)
+            loads.append(load)
+
+    # Cheapest insertion for everything left over
+    for stop_idx in leftovers:
+        best = None
+        for r, route in enumerate(routes):
+            if loads[r] + demands[stop_idx] > capacity:
+                continue
+            path = [depot_index] + route + [depot_index]
+            for pos in range(len(path) - 1):
+                cost = dist_matrix[path[pos]][stop_idx] + dist_matrix[stop_idx][path[pos + 1]] - dist_matrix[path[pos]][path[pos + 1]]
+                if best is None or cost < best[0]:
+                    best = (cost, r, pos)
+        if best is None:
+            routes.append([stop_idx])
+            loads.append(demands[stop_idx])
+        else:
+            _, r, pos = best
+            routes[r].insert(pos, stop_idx)
+            loads[r] += demands[stop_idx]
+
+    print(f"Warm start: {len(stop_indices) - len(leftovers)} of {len(stop_indices)} stops matched to previous routes, {len(routes)} routes")
+    return routes
+
+
 # Splits stops with demand exceeding bus capacity into multiple sub stops
 def split_large_stops(stop_df: pd.DataFrame, bus_capacity: int) -> pd.DataFrame:
     new_stops = []
@@ -185,24 +395,168 @@ def split_large_stops(stop_df: pd.DataFrame, bus_capacity: int) -> pd.DataFrame:
     return pd.DataFrame(new_stops)
 
 
-# Computes shortest driving distances between all stops using netwrok graph
-def build_distance_matrix(G: nx.Graph, stop_nodes: List[int]) -> np.ndarray:
-    n = len(stop_nodes)
-    dist_matrix = np.zeros((n, n))
-    np.fill_diagonal(dist_matrix, 0)
-    
-    for i, source_node in enumerate(stop_nodes):
+# Converts road graph to a SciPy CSR adjacency matrix once (shortest parallel edge kept) & caches it on the graph
+# Graphs loaded from the graph store are converted straight from the saved arrays
+def graph_to_csr(G: nx.Graph) -> Tuple[csr_matrix, np.ndarray, Dict[int, int]]:
+    cached = G.graph.get("_csr")
+    if cached is not None:
+        return cached
+
+    if G.graph.get("store_path"):
+        arrays = stored_arrays(G)
+        node_ids = np.asarray(arrays["node_ids"])
+        u = np.asarray(arrays["edge_u"])
+        v = np.asarray(arrays["edge_v"])
+        length = np.asarray(arrays["edge_length"])
+    else:
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        position = {node: i for i, node in enumerate(node_ids.tolist())}
+        edges = list(G.edges(data='length', default=0.0))
+        u = np.array([position[a] for a, _, _ in edges], dtype=np.int32)
+        v = np.array([position[b] for _, b, _ in edges], dtype=np.int32)
+        length = np.array([l for _, _, l in edges], dtype=np.float64)
+
+    # csr_matrix sums duplicate entries, so only the shortest edge between each pair of nodes is kept
+    order = np.lexsort((length, v, u))
+    u, v, length = u[order], v[order], length[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+
+    n = len(node_ids)
+    csr = csr_matrix((length[first], (u[first], v[first])), shape=(n, n))
+    position = {node: i for i, node in enumerate(node_ids.tolist())}
+
+    G.graph["_csr"] = (csr, node_ids, position)
+    return G.graph["_csr"]
+
+# Latitudes & longitudes of graph nodes (read from the memory mapped arrays for graphs from the graph store)
+def node_coordinates(G, nodes: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    if G.graph.get("store_path"):
+        position = graph_to_csr(G)[2]
+        arrays = stored_arrays(G)
+        idx = np.array([position[n] for n in nodes], dtype=np.int64)
+        return np.asarray(arrays["node_y"][idx]), np.asarray(arrays["node_x"][idx])
+    return np.array([G.nodes[n]['y'] for n in nodes]), np.array([G.nodes[n]['x'] for n in nodes])
+
+# Estimates how far Dijkstra must search: longest straight line between any two nodes times a detour factor
+def _search_radius(G, nodes: List[int], detour_factor: float = DETOUR_FACTOR) -> float:
+    lat, lon = (np.radians(c) for c in node_coordinates(G, nodes))
+    span = haversine_distances(np.column_stack([lat, lon])).max() * EARTH_RADIUS_M
+    return max(span * detour_factor, 1000.0)
+
+# Runs SciPy's C Dijkstra from every node with a bounded search radius
+# Sources that didn't settle every target inside the radius are rerun unbounded (or up to limit), so the search stops close to the farthest target
+def _csgraph_node_distances(G: nx.Graph, nodes: List[int], limit: float = None, batch_size: int = 64) -> np.ndarray:
+    csr, _, position = graph_to_csr(G)
+    idx = np.array([position[node] for node in nodes], dtype=np.int64)
+    radius = _search_radius(G, nodes)
+    first_limit = min(radius, limit) if limit is not None else radius
+    final_limit = limit if limit is not None else np.inf
+
+    node_dist = np.empty((len(idx), len(idx)))
+
+    # Batches sources so only batch_size full distance rows are in memory at a time
+    for start in range(0, len(idx), batch_size):
+        sources = idx[start:start + batch_size]
+        rows = slice(start, start + len(sources))
+        node_dist[rows] = dijkstra(csr, directed=True, indices=sources, limit=first_limit)[:, idx]
+
+        unsettled = np.nonzero(np.isinf(node_dist[rows]).any(axis=1))[0]
+        if len(unsettled) and final_limit > first_limit:
+            node_dist[start + unsettled] = dijkstra(csr, directed=True, indices=sources[unsettled], limit=final_limit)[:, idx]
+
+    return node_dist
+
+# Runs one shortest path sweep from every unique node & returns the distances between them
+# The result feeds both the distance matrix (build_distance_matrix base) & the route drawing (map.route_leg_paths bounds its searches with it)
+def shortest_path_sweep(G: nx.Graph, nodes: List[int], engine: str = "csgraph", limit: float = None) -> dict:
+    unique_nodes = list(dict.fromkeys(nodes))
+    sweep = {"nodes": unique_nodes, "dist": None, "engine": engine}
+
+    if engine == "csgraph":
+        sweep["dist"] = _csgraph_node_distances(G, unique_nodes, limit=limit)
+        return sweep
+    if engine != "networkx":
+        raise ValueError(f"Unknown distance engine: {engine}")
+    G = as_networkx(G)
+
+    n = len(unique_nodes)
+    node_dist = np.zeros((n, n))
+
+    for i, source_node in enumerate(unique_nodes):
         try:
-            distances = nx.single_source_dijkstra_path_length(G, source_node, weight='length')
-            for j, target_node in enumerate(stop_nodes):
+            distances = nx.single_source_dijkstra_path_length(G, source_node, cutoff=limit, weight='length')
+            for j, target_node in enumerate(unique_nodes):
                 if target_node in distances:
-                    dist_matrix[i, j] = distances[target_node]
+                    node_dist[i, j] = distances[target_node]
         except Exception:
             continue
-    
+
+    sweep["dist"] = node_dist
+    return sweep
+
+# Rebuilds shortest paths of (orig, dest) graph node legs after the solve, running Dijkstra only from leg origins in batches
+# Only batch_size predecessor rows (int32 over every graph node) exist at a time; known leg distances bound each batch's search
+def shortest_leg_paths(G: nx.Graph, legs: List[Tuple[int, int]], leg_distances: dict = None, batch_size: int = 64) -> dict:
+    csr, node_ids, position = graph_to_csr(G)
+    targets = {}
+    for orig, dest in legs:
+        if orig != dest:
+            targets.setdefault(orig, set()).add(dest)
+    origins = list(targets)
+
+    paths = {}
+    for start in range(0, len(origins), batch_size):
+        batch = origins[start:start + batch_size]
+        limit = np.inf
+        if leg_distances:
+            longest = max(leg_distances.get((orig, dest), np.inf) for orig in batch for dest in targets[orig])
+            if np.isfinite(longest):
+                limit = longest * (1 + 1e-9) + 1.0  # slack so float rounding never leaves the farthest target unsettled
+        _, predecessors = dijkstra(csr, directed=True, indices=[position[orig] for orig in batch], limit=limit, return_predecessors=True)
+
+        # Walks predecessors back from each dest until reaching orig (negative means unreachable)
+        for row, orig in enumerate(batch):
+            source = position[orig]
+            for dest in targets[orig]:
+                current = position[dest]
+                path = [current]
+                while current != source:
+                    current = predecessors[row, current]
+                    if current < 0:
+                        path = None
+                        break
+                    path.append(current)
+                if path:
+                    paths[(orig, dest)] = node_ids[path[::-1]].tolist()
+        del predecessors
+
+    return paths
+
+# Computes shortest driving distances between unique graph nodes using netwrok graph
+# Stops that share a node (split stops keep their parent's graph_node) only cost one Dijkstra run
+# engine="csgraph" uses SciPy on a CSR matrix (unreachable pairs become 1e6), engine="networkx" runs the pure Python Dijkstra
+def build_node_distance_matrix(G: nx.Graph, nodes: List[int], engine: str = "csgraph", limit: float = None) -> Tuple[List[int], np.ndarray]:
+    sweep = shortest_path_sweep(G, nodes, engine=engine, limit=limit)
+    return sweep["nodes"], sweep["dist"]
+
+# Expands a unique node matrix to one row & column per stop by index mapping
+def expand_distance_matrix(unique_nodes: List[int], node_dist: np.ndarray, stop_nodes: List[int]) -> np.ndarray:
+    position = {node: i for i, node in enumerate(unique_nodes)}
+    idx = np.array([position[node] for node in stop_nodes], dtype=int)
+
+    dist_matrix = node_dist[np.ix_(idx, idx)]
     dist_matrix = np.nan_to_num(dist_matrix, nan=1e6, posinf=1e6, neginf=1e6)
     dist_matrix = dist_matrix.astype(int)
-    
+
     return dist_matrix
 
+# Computes shortest driving distances between all stops using netwrok graph
+# base=(unique_nodes, node_dist) from an earlier build_node_distance_matrix call is reused when it covers every stop node
+def build_distance_matrix(G: nx.Graph, stop_nodes: List[int], base: Tuple[List[int], np.ndarray] = None, engine: str = "csgraph") -> np.ndarray:
+    if base is None:
+        base = build_node_distance_matrix(G, stop_nodes, engine=engine)
+    elif not set(stop_nodes).issubset(base[0]):
+        base = build_node_distance_matrix(G, list(base[0]) + list(stop_nodes), engine=engine)
 
+    return expand_distance_matrix(base[0], base[1], stop_nodes)
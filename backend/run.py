@@ -30,10 +30,27 @@ class RunPayload(BaseModel):
     total_bus_riders: int
     buses_needed: int
     overview: Optional[List[dict]] = None
+    elbow: Optional[dict] = None
+    stage_timings: Optional[List[dict]] = None
     map_path: Optional[str] = None
     route_details: List[RoutePayload]
 
 
+class StudentDelta(BaseModel):
+    student_id: str
+    name: Optional[str] = None
+    latitude: float
+    longitude: float
+
+
+class RosterDeltaPayload(BaseModel):
+    adds: List[StudentDelta] = []
+    removes: List[str] = []
+    moves: List[StudentDelta] = []
+    name: Optional[str] = None
+    bus_capacity: int = 45
+
+
 class FeedbackPayload(BaseModel):
     user_id: Optional[int] = None
     route_id: Optional[int] = None
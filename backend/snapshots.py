@@ -0,0 +1,92 @@
+'''
+    - Caches the published run as ready to send JSON (plus a gzip copy) with an ETag, so repeat reads skip the database
+    - Snapshots also carry a student_id --> assignment index for the student lookup endpoints
+    - Invalidated whenever the published plan could change (publish, delete, save, address fill, student updates)
+    - PUBLISHED_SNAPSHOT_TTL_S bounds staleness when several API worker processes each hold their own copy (0 = never expires)
+'''
+
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+from typing import Dict, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+PUBLISHED_SNAPSHOT_TTL_S = float(os.getenv("PUBLISHED_SNAPSHOT_TTL_S", "300"))
+SNAPSHOT_GZIP_MIN_BYTES = 1024
+
+_snapshot = None
+_version = 0
+_lock = threading.Lock()
+
+
+# Current cache version --> read before building a snapshot & pass to store_snapshot
+def snapshot_version() -> int:
+    return _version
+
+# Serializes a payload the same way FastAPI's JSONResponse does & precomputes gzip body & ETag
+def make_snapshot(run_id: int, payload: Dict, **extra) -> Dict:
+    body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return {
+        "run_id": run_id,
+        "body": body,
+        "gzip_body": gzip.compress(body, compresslevel=6) if len(body) >= SNAPSHOT_GZIP_MIN_BYTES else None,
+        "etag": f'"run-{run_id}-{hashlib.sha256(body).hexdigest()[:20]}"',
+        "built_at": time.time(),
+        **extra
+    }
+
+# Snapshot for "nothing is published" (cached too, so lookups don't query for a missing run every time)
+def empty_snapshot(**extra) -> Dict:
+    return {"run_id": None, "body": b"", "gzip_body": None, "etag": None, "built_at": time.time(), **extra}
+
+# Stores a snapshot unless the cache was invalidated while it was being built
+def store_snapshot(snapshot: Dict, version: int) -> bool:
+    global _snapshot
+    with _lock:
+        if version != _version:
+            return False
+        _snapshot = snapshot
+    if snapshot["run_id"] is not None:
+        print(f"Cached published run {snapshot['run_id']} snapshot ({len(snapshot['body']) / 1024:.1f} KB)")
+    return True
+
+# Returns the cached snapshot (None when empty or expired)
+def get_snapshot() -> Optional[Dict]:
+    snapshot = _snapshot
+    if snapshot is None:
+        return None
+    if PUBLISHED_SNAPSHOT_TTL_S > 0 and time.time() - snapshot["built_at"] > PUBLISHED_SNAPSHOT_TTL_S:
+        return None
+    return snapshot
+
+def invalidate_snapshot(reason: str = ""):
+    global _snapshot, _version
+    with _lock:
+        _version += 1
+        had_snapshot = _snapshot is not None
+        _snapshot = None
+    if had_snapshot:
+        print(f"Published run snapshot invalidated{f' ({reason})' if reason else ''}")
+
+
+# Checks an If-None-Match header against the ETag (handles lists, weak validators & *)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+# Builds the HTTP response for a snapshot: 304 when the client has it, gzip body when accepted
+def snapshot_response(snapshot: Dict, request: Request) -> Response:
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), snapshot["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    if snapshot["gzip_body"] is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=snapshot["gzip_body"], media_type="application/json", headers=headers)
+    return Response(content=snapshot["body"], media_type="application/json", headers=headers)
@@ -0,0 +1,90 @@
+'''
+    - Regression tests for /reoptimize_run roster changes (run from backend/: python -m pytest tests)
+    - Uses a throwaway SQLite database & the offline geocoder
+'''
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ["GEOCODER"] = "offline"
+os.chdir(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.testclient import TestClient
+import main
+from database import Base, engine, session_scope
+from db_models import OptimizationRun, Student
+from models.incremental import apply_roster_changes
+
+Base.metadata.create_all(engine)
+client = TestClient(main.app)
+
+SCHOOL = main.SCHOOL_COORDS
+
+
+def saved_run() -> int:
+    stops = [
+        {"latitude": 40.55, "longitude": -74.60 + i * 0.003, "sequence_number": i + 1, "students": [
+            {"student_id": f"R{i}", "name": f"Rider {i}", "pickup_time": "2025-01-01T07:15:00", "latitude": 40.55, "longitude": -74.60 + i * 0.003}
+        ]}
+        for i in range(2)
+    ]
+    payload = {
+        "name": "base", "total_students_uploaded": 2, "total_walkers": 0, "total_bus_riders": 2, "buses_needed": 1,
+        "overview": [{"Metric": "Total Students", "Value": 2}],
+        "route_details": [{"bus_number": 1, "total_students": 2, "total_distance_km": 10.0, "estimated_duration_hr": 0.3, "stops": stops}]
+    }
+    return client.post("/save_run", json=payload).json()["run_id"]
+
+
+def test_added_student_without_name_is_named_by_id():
+    routes = [{"bus_number": 1, "total_distance_km": 10.0, "stops": [
+        {"latitude": 40.55, "longitude": -74.60, "students": [{"student_id": "R0", "name": "Rider 0", "pickup_time": None, "latitude": 40.55, "longitude": -74.60}]}
+    ]}]
+    updated, _ = apply_roster_changes(routes, {"adds": [{"student_id": "d", "latitude": 40.552, "longitude": -74.602}]}, SCHOOL, safe_walk_km=1.0)
+    names = {s["student_id"]: s["name"] for stop in updated[0]["stops"] for s in stop["students"]}
+    assert names["d"] == "d"
+
+
+def test_reoptimize_run_accepts_adds_without_name():
+    run_id = saved_run()
+    response = client.post(f"/reoptimize_run/{run_id}", json={"adds": [
+        {"student_id": "d", "latitude": 40.552, "longitude": -74.602},
+        {"student_id": "w", "latitude": SCHOOL[0], "longitude": SCHOOL[1]}
+    ]})
+    assert response.status_code == 200, response.text
+    assert response.json()["new_walkers"] == ["w"]
+
+    new_run = client.get(f"/get_run/{response.json()['run_id']}").json()
+    names = {s["student_id"]: s["name"] for route in new_run["routes"] for stop in route["stops"] for s in stop["students"]}
+    assert names["d"] == "d"
+
+
+def test_reoptimize_run_counts_moved_walkers_and_updates_walker_status():
+    run_id = saved_run()
+    with session_scope() as db:
+        db.query(OptimizationRun).filter_by(run_id=run_id).update({"total_walkers": 10})
+        for student_id in ("W1", "W2"):
+            db.merge(Student(student_id=student_id, name=student_id, home_latitude=SCHOOL[0], home_longitude=SCHOOL[1], is_walker=True))
+        db.commit()
+
+    response = client.post(f"/reoptimize_run/{run_id}", json={"moves": [
+        {"student_id": "W1", "latitude": SCHOOL[0] + 0.0001, "longitude": SCHOOL[1]},
+        {"student_id": "W2", "latitude": 40.552, "longitude": -74.602}
+    ]})
+    assert response.status_code == 200, response.text
+
+    new_run = client.get(f"/get_run/{response.json()['run_id']}").json()
+    assert new_run["map_path"] is None
+    assert all(route["map_path"] is None for route in new_run["routes"])
+
+    with session_scope() as db:
+        saved = db.get(OptimizationRun, response.json()["run_id"])
+        assert saved.total_walkers == 9
+        assert saved.total_students_uploaded == saved.total_bus_riders + 9
+        assert db.get(Student, "W1").is_walker
+        assert db.get(Student, "W1").walking_distance_km is not None
+        assert not db.get(Student, "W2").is_walker
@@ -27,6 +27,22 @@ export default function DataUpload({ onPublish }) {
 		setSelectedFile(event.target.files[0]);
 	};
 
+	const waitForJob = async (jobId) => {
+		while (true) {
+			const statusResponse = await fetch(`http://localhost:8000/jobs/${jobId}`);
+			if (!statusResponse.ok) throw new Error("Optimization job not found!");
+			const job = await statusResponse.json();
+
+			if (job.status === "failed") throw new Error(job.error || "Optimization failed!");
+			if (job.status === "done") {
+				const resultResponse = await fetch(`http://localhost:8000/jobs/${jobId}/result`);
+				if (!resultResponse.ok) throw new Error("Optimization failed!");
+				return resultResponse.json();
+			}
+			await new Promise((resolve) => setTimeout(resolve, 2000));
+		}
+	};
+
 	const handleRunAndSave = async () => {
 
 		if (!selectedFile) {
@@ -59,12 +75,14 @@ export default function DataUpload({ onPublish }) {
 			formData2.append("num_bus", numBuses);
 			formData2.append("bus_capacity", busCapacity);
 
-			const uploadResponse = await fetch("http://localhost:8000/upload_csv", {
+			// Queues the optimization & polls the job until the result is ready
+			const jobResponse = await fetch("http://localhost:8000/jobs/optimize", {
 				method: "POST",
 				body: formData2,
 			});
-			if (!uploadResponse.ok) throw new Error("Optimization failed!");
-			const data = await uploadResponse.json();
+			if (!jobResponse.ok) throw new Error("Optimization failed!");
+			const { job_id } = await jobResponse.json();
+			const data = await waitForJob(job_id);
 
 			setOverview(data.overview || []);
 			setRouteDetails(data.route_details || []);
@@ -82,6 +100,8 @@ export default function DataUpload({ onPublish }) {
 				buses_needed:
 					data.overview.find((o) => o.Metric === "Total Buses")?.Value || 0,
 				overview: data.overview,
+				elbow: data.elbow || null,
+				stage_timings: data.stage_timings || null,
 				map_path: data.map_path
 					? data.map_path.replace("http://localhost:8000/", "")
 					: null,
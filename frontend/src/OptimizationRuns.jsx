@@ -326,7 +326,7 @@ export default function OptimizationRuns({ autoOpenRunId }) {
 															<div className="stop-number">
 																Stop {stop.sequence_number}
 															</div>
-															<div className="stop-address">{stop.address}</div>
+															<div className="stop-address">{stop.address || "Address pending..."}</div>
 															<div className="stop-coordinates">
 																({stop.latitude}, {stop.longitude})
 															</div>